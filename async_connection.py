@@ -0,0 +1,252 @@
+"""Async variant of the read side of connection.py, for async views.
+
+The functions mirror connection.py's names and return the same shapes, and
+run the same SQL. Queries go through a psycopg 3 AsyncConnectionPool that
+lives on its own event loop thread: Flask runs each async view in a fresh
+loop, and a pool cannot be shared between loops. Awaiting a query from
+any loop hands it to the pool's loop and suspends the caller until the
+rows are back, so a view can overlap several queries with asyncio.gather.
+
+The topic catalog, question sampler, per-request question memo and replica
+health are the ones connection.py keeps, so both layers see the same
+invalidations and route reads to the same replicas.
+
+No view uses this module yet. Under Flask every async view runs on its
+own loop in a worker thread, so each query pays a hop to the pool's loop
+and back; benchmarks/async_bench.py measured that at about two thirds of
+the sync layer's throughput. Views switch only once the bench shows a
+gain, e.g. with an ASGI-native server and a pool on the serving loop.
+
+Its pools, opened on first use, come on top of connection.py's, so each
+process can hold up to DB_POOL_MAX + ASYNC_DB_POOL_MAX connections to the
+primary and as many again to every replica. Size both, times the number of
+worker processes, to fit within the servers' max_connections.
+"""
+import asyncio
+import atexit
+import threading
+import time
+from datetime import datetime
+from os import environ as env
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+import connection
+from connection import (DATABASE_REPLICA_URLS, DATABASE_URL, MASTERY_CANDIDATES,
+                        MASTERY_WIDE_CANDIDATES,
+                        QUESTION_PAGE_MAX, QUESTION_PAGE_SIZE,
+                        REPLICA_CONNECT_TIMEOUT, REPLICA_POOL_TIMEOUT,
+                        _ADAPTIVE_SQL, _EXAM_QUESTION_IDS_SQL, _EXAM_SQL,
+                        _QUESTION_PAGE_SQL, _QUESTIONS_SQL, _exam_row,
+                        _question_memo, _question_page, _question_rows,
+                        _read_target, _replicas, _sampler, _topic_updated_at)
+from querylog import query_log
+
+T = TypeVar("T")
+
+
+class InstrumentedAsyncCursor(psycopg.AsyncCursor):
+    """Async cursor that reports every statement's duration and row count
+    to `query_log`, like querylog.InstrumentedCursor."""
+
+    async def execute(self, query, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            query_log.record_query(query, time.perf_counter() - started, self.rowcount)
+
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_pool: Optional[AsyncConnectionPool] = None
+_replica_pools: dict[str, AsyncConnectionPool] = {}
+
+
+def _start() -> tuple[asyncio.AbstractEventLoop, AsyncConnectionPool]:
+    """Starts the pools' event loop thread and opens the pools, once."""
+
+    global _loop, _pool, _replica_pools
+    with _lock:
+        if _pool is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-db", daemon=True).start()
+
+            async def open_pool(conninfo: str, timeout: float,
+                                **kwargs: Any) -> AsyncConnectionPool:
+                pool = AsyncConnectionPool(
+                    conninfo,
+                    min_size=int(env.get("ASYNC_DB_POOL_MIN", 1)),
+                    max_size=int(env.get("ASYNC_DB_POOL_MAX", 10)),
+                    timeout=timeout,
+                    max_idle=float(env.get("DB_POOL_MAX_IDLE", 30)),
+                    kwargs={"cursor_factory": InstrumentedAsyncCursor, **kwargs},
+                    open=False)
+                await pool.open()
+                return pool
+
+            def open_sync(conninfo: str, timeout: float, **kwargs: Any) -> AsyncConnectionPool:
+                return asyncio.run_coroutine_threadsafe(
+                    open_pool(conninfo, timeout, **kwargs), loop).result()
+
+            _replica_pools = {dsn: open_sync(dsn, REPLICA_POOL_TIMEOUT,
+                                             connect_timeout=REPLICA_CONNECT_TIMEOUT)
+                              for dsn in DATABASE_REPLICA_URLS}
+            _pool = open_sync(DATABASE_URL, float(env.get("DB_POOL_TIMEOUT", 5)))
+            _loop = loop
+            atexit.register(close)
+        return _loop, _pool
+
+
+def close() -> None:
+    global _loop, _pool, _replica_pools
+    with _lock:
+        if _pool is None:
+            return
+        loop, pools = _loop, [_pool, *_replica_pools.values()]
+        _loop, _pool, _replica_pools = None, None, {}
+    for pool in pools:
+        asyncio.run_coroutine_threadsafe(pool.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def run(coro: Awaitable[T]) -> T:
+    """Runs a coroutine on the pool's loop from synchronous code and waits
+    for its result. Coroutines run this way skip the hop between loops."""
+
+    loop, _ = _start()
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def get_pool_stats() -> Optional[dict[str, Any]]:
+    if _pool is None:
+        return None
+    return {**_pool.get_stats(),
+            "replicas": [pool.get_stats() for pool in _replica_pools.values()]}
+
+
+async def _with_connection(work: Callable[[psycopg.AsyncConnection], Awaitable[T]],
+                           fresh_since: Optional[datetime] = None) -> T:
+    """Runs read-only `work` with a pooled connection, committing when it
+    returns and rolling back if it raises. Like connection.read_query() it
+    uses a replica that is keeping up when there is one, else the primary,
+    and reruns `work` on the primary if the replica fails. Queries count
+    towards the caller's request."""
+
+    loop, pool = _start()
+    stats = query_log.current()
+    dsn = _read_target(fresh_since)
+
+    async def run_on(target: AsyncConnectionPool) -> T:
+        started = time.perf_counter()
+        async with target.connection() as conn:
+            query_log.record_checkout(time.perf_counter() - started)
+            return await work(conn)
+
+    async def checkout() -> T:
+        query_log.bind(stats)
+        if dsn is not None:
+            try:
+                return await run_on(_replica_pools[dsn])
+            except PoolTimeout:
+                _replicas.mark_busy(dsn)
+            except psycopg.OperationalError as e:
+                _replicas.mark_down(dsn, e)
+        return await run_on(pool)
+
+    if asyncio.get_running_loop() is loop:
+        return await checkout()
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(checkout(), loop))
+
+
+async def _fetchall(sql: str, params: Any,
+                    fresh_since: Optional[datetime] = None) -> list[tuple]:
+    async def work(conn: psycopg.AsyncConnection) -> list[tuple]:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchall()
+    return await _with_connection(work, fresh_since)
+
+
+async def _fetchone(sql: str, params: Any) -> Optional[tuple]:
+    async def work(conn: psycopg.AsyncConnection) -> Optional[tuple]:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchone()
+    return await _with_connection(work)
+
+
+# The catalog and sampler answer from memory and only query on a reload,
+# at most once per TTL or invalidation, so they are called directly.
+
+async def get_all_topics() -> list[dict[str, Any]]:
+    return connection.get_all_topics()
+
+
+async def get_topic_by_id(topic_id: int) -> Optional[dict[str, Any]]:
+    return connection.get_topic_by_id(topic_id)
+
+
+async def get_topic_catalog_version() -> str:
+    return connection.get_topic_catalog_version()
+
+
+async def get_questions_for_topic(
+        topic_id: int, before: Optional[int] = None,
+        limit: int = QUESTION_PAGE_SIZE) -> tuple[list[dict[str, Any]], Optional[int]]:
+    limit = max(1, min(limit, QUESTION_PAGE_MAX))
+    rows = await _fetchall(_QUESTION_PAGE_SQL,
+                           {"topic_id": topic_id, "before": before, "limit": limit + 1},
+                           _topic_updated_at(topic_id))
+    return _question_page(rows, limit)
+
+
+async def load_questions(question_ids: list[int]) -> dict[int, dict[str, Any]]:
+    memo = _question_memo()
+    missing = [qid for qid in dict.fromkeys(question_ids) if qid not in memo]
+    if missing:
+        memo.update(_question_rows(await _fetchall(_QUESTIONS_SQL, (missing,))))
+    return {qid: memo[qid] for qid in question_ids if qid in memo}
+
+
+async def get_question_with_answers(question_id: int) -> Optional[dict[str, Any]]:
+    return (await load_questions([question_id])).get(question_id)
+
+
+async def get_random_question_for_topic(topic_id: int) -> Optional[dict[str, Any]]:
+    for _ in range(3):
+        sampled = _sampler.sample_topic(topic_id)
+        if not sampled:
+            return None
+
+        question = await get_question_with_answers(sampled[0])
+        if question:
+            return question
+        _sampler.remove(topic_id, sampled[0])
+
+    return None
+
+
+async def get_next_adaptive_question(user_id: int, topic_id: int) -> Optional[dict[str, Any]]:
+    for k in (MASTERY_CANDIDATES, MASTERY_WIDE_CANDIDATES):
+        candidates = _sampler.sample_topic(topic_id, k)
+        row = await _fetchone(_ADAPTIVE_SQL,
+                              {"user_id": user_id, "topic_id": topic_id,
+                               "candidates": candidates})
+        if not row:
+            return None
+        if row[1] < 2 or len(candidates) < k:
+            break
+    return await get_question_with_answers(row[0])
+
+
+async def get_exam(exam_id: int) -> Optional[dict[str, Any]]:
+    return _exam_row(exam_id, await _fetchone(_EXAM_SQL, (exam_id,)))
+
+
+async def get_exam_questions(exam_id: int) -> list[dict[str, Any]]:
+    question_ids = [row[0] for row in await _fetchall(_EXAM_QUESTION_IDS_SQL, (exam_id,))]
+    questions = await load_questions(question_ids)
+    return [questions[qid] for qid in question_ids if qid in questions]
@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from werkzeug.security import (DEFAULT_PBKDF2_ITERATIONS, check_password_hash,
+                               generate_password_hash)
+
+T = TypeVar("T")
+
+
+class HasherBusy(RuntimeError):
+    """Raised when the hashing queue is full and no slot freed up in time."""
+
+
+def password_method(iterations: int) -> str:
+    return f"pbkdf2:sha256:{iterations}"
+
+
+def needs_rehash(password_hash: str, method: str) -> bool:
+    """True if a stored hash was made with different parameters than `method`."""
+    return password_hash.split("$", 1)[0] != method
+
+
+class PasswordHasher:
+    """Runs PBKDF2 hashing and verification on a small dedicated thread pool.
+
+    hashlib releases the GIL while it works, so `workers` threads keep at
+    most that many cores busy with password work no matter how many requests
+    arrive. At most `max_pending` jobs may be queued or running; past that,
+    callers wait up to `timeout` seconds for a slot and then get HasherBusy.
+    """
+
+    def __init__(self, iterations: int = DEFAULT_PBKDF2_ITERATIONS,
+                 workers: int = 2, max_pending: int = 32, timeout: float = 5.0,
+                 salt_length: int = 16):
+        self.method = password_method(iterations)
+        self.salt_length = salt_length
+        self.timeout = timeout
+
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="password-hasher")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self.jobs = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._queue_time = 0.0
+        self._max_queue_time = 0.0
+        self._run_time = 0.0
+        self._max_run_time = 0.0
+
+    def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        submitted = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy("Password hashing queue is full")
+
+        def job() -> tuple[T, float, float]:
+            started = time.monotonic()
+            result = fn(*args)
+            return result, started - submitted, time.monotonic() - started
+
+        with self._lock:
+            self._pending += 1
+        try:
+            result, queued, ran = self._executor.submit(job).result()
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._pending -= 1
+
+        with self._lock:
+            self.jobs += 1
+            self._queue_time += queued
+            self._max_queue_time = max(self._max_queue_time, queued)
+            self._run_time += ran
+            self._max_run_time = max(self._max_run_time, ran)
+        return result
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method,
+                         self.salt_length)
+
+    def verify(self, password_hash: str, password: str) -> tuple[bool, Optional[str]]:
+        """Checks a password. Returns (ok, new_hash); new_hash is set when
+        the password was right but the stored hash uses old parameters."""
+
+        if not self._run(check_password_hash, password_hash, password):
+            return False, None
+        if not needs_rehash(password_hash, self.method):
+            return True, None
+
+        new_hash = self.hash(password)
+        with self._lock:
+            self.rehashed += 1
+        return True, new_hash
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "method": self.method,
+                "pending": self._pending,
+                "jobs": self.jobs,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "avg_queue_ms": 1000 * self._queue_time / self.jobs if self.jobs else 0.0,
+                "max_queue_ms": 1000 * self._max_queue_time,
+                "avg_hash_ms": 1000 * self._run_time / self.jobs if self.jobs else 0.0,
+                "max_hash_ms": 1000 * self._max_run_time,
+            }
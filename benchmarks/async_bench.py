@@ -0,0 +1,179 @@
+"""Compares throughput of the sync and async data layers on the hot read paths.
+
+    python benchmarks/seed_bench.py
+    python benchmarks/async_bench.py --concurrency 64 --duration 30
+
+Each simulated exam taker loads the topic list, a page of a topic, a
+practice question and one of the seeded open exams, over and over. In sync
+mode every taker is a thread calling connection.py; in async mode every
+taker is a task on async_connection.py's event loop, and the exam is
+fetched with its questions in parallel as the take_exam view does.
+
+Both layers cap database connections at their pool size (DB_POOL_MAX and
+ASYNC_DB_POOL_MAX); keep the two equal for a like-for-like comparison.
+Visits that time out waiting for a pooled connection are counted and
+reported rather than ending the taker.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+import psycopg_pool
+
+import async_connection
+import connection
+import pool
+from route_bench import percentile
+from seed_bench import TOPIC_PREFIX, USER_PREFIX
+
+
+def load_targets(limit: int = 1000) -> tuple[list[int], list[int]]:
+    with connection.pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT topic_id FROM topic
+            WHERE topic_name LIKE %s AND hidden_at IS NULL;
+        """, (TOPIC_PREFIX + "%",))
+        topic_ids = [r[0] for r in cur.fetchall()]
+        cur.execute("""
+            SELECT e.exam_id
+            FROM exam e
+            JOIN users u ON u.user_id = e.user_id
+            WHERE u.username LIKE %s AND e.end_time IS NULL
+            LIMIT %s;
+        """, (USER_PREFIX + "%", limit))
+        exam_ids = [r[0] for r in cur.fetchall()]
+    return topic_ids, exam_ids
+
+
+def visit_sync(rng: random.Random, topic_ids: list[int], exam_ids: list[int]) -> None:
+    topic_id = rng.choice(topic_ids)
+    connection.get_all_topics()
+    connection.get_questions_for_topic(topic_id)
+    connection.get_random_question_for_topic(topic_id)
+    exam_id = rng.choice(exam_ids)
+    connection.get_exam(exam_id)
+    connection.get_exam_questions(exam_id)
+
+
+async def visit_async(rng: random.Random, topic_ids: list[int], exam_ids: list[int]) -> None:
+    topic_id = rng.choice(topic_ids)
+    await async_connection.get_all_topics()
+    await async_connection.get_questions_for_topic(topic_id)
+    await async_connection.get_random_question_for_topic(topic_id)
+    exam_id = rng.choice(exam_ids)
+    await asyncio.gather(async_connection.get_exam(exam_id),
+                         async_connection.get_exam_questions(exam_id))
+
+
+def summarize(latencies: list[float], timeouts: int, seconds: float) -> dict[str, Any]:
+    ms = [s * 1000 for s in latencies]
+    return {"visits": len(ms),
+            "timeouts": timeouts,
+            "visits_per_second": len(ms) / seconds if seconds else 0.0,
+            "p50_ms": percentile(ms, 50) if ms else 0.0,
+            "p95_ms": percentile(ms, 95) if ms else 0.0,
+            "p99_ms": percentile(ms, 99) if ms else 0.0}
+
+
+def run_sync(args: argparse.Namespace, topic_ids: list[int],
+             exam_ids: list[int]) -> dict[str, Any]:
+    lock = threading.Lock()
+    latencies: list[float] = []
+    timeouts = 0
+    deadline = time.monotonic() + args.duration
+
+    def taker(index: int) -> None:
+        nonlocal timeouts
+        rng = random.Random(index)
+        mine = []
+        timed_out = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                visit_sync(rng, topic_ids, exam_ids)
+            except pool.PoolTimeout:
+                timed_out += 1
+                continue
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+            timeouts += timed_out
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=taker, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, timeouts, time.monotonic() - started)
+
+
+async def run_async(args: argparse.Namespace, topic_ids: list[int],
+                    exam_ids: list[int]) -> dict[str, Any]:
+    latencies: list[float] = []
+    timeouts = 0
+    deadline = time.monotonic() + args.duration
+
+    async def taker(index: int) -> None:
+        nonlocal timeouts
+        rng = random.Random(index)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                await visit_async(rng, topic_ids, exam_ids)
+            except psycopg_pool.PoolTimeout:
+                timeouts += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(taker(i) for i in range(args.concurrency)))
+    return summarize(latencies, timeouts, time.monotonic() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="simulated exam takers")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per mode")
+    parser.add_argument("--mode", choices=("sync", "async", "both"), default="both")
+    args = parser.parse_args()
+
+    topic_ids, exam_ids = load_targets()
+    if not topic_ids or not exam_ids:
+        sys.exit("No benchmark data found; run benchmarks/seed_bench.py first")
+
+    results = {}
+    if args.mode in ("sync", "both"):
+        rng = random.Random(0)
+        visit_sync(rng, topic_ids, exam_ids)
+        results["sync"] = run_sync(args, topic_ids, exam_ids)
+    if args.mode in ("async", "both"):
+        rng = random.Random(0)
+        async_connection.run(visit_async(rng, topic_ids, exam_ids))
+        results["async"] = async_connection.run(run_async(args, topic_ids, exam_ids))
+
+    print(f"{args.concurrency} concurrent takers, pools: "
+          f"sync {connection.get_pool_stats()['max_size']}, "
+          f"async {(async_connection.get_pool_stats() or {}).get('pool_max', '-')} connections")
+    print(f"{'mode':<6} {'visits':>8} {'visits/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'timeouts':>9}")
+    for mode, r in results.items():
+        print(f"{mode:<6} {r['visits']:>8} {r['visits_per_second']:>9.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['timeouts']:>9}")
+    if len(results) == 2 and results["sync"]["visits_per_second"]:
+        print(f"async/sync throughput: "
+              f"{results['async']['visits_per_second'] / results['sync']['visits_per_second']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Measures importer parser throughput on a synthetic practice-test corpus.
+
+    python benchmarks/parser_bench.py --questions 50000
+    python benchmarks/parser_bench.py --write corpus.txt --questions 1000
+
+With --min-lines-per-sec the script exits non-zero when either parser is
+slower than the given throughput, so it can be used as a regression check.
+"""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+from typing import Iterator
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+from importer import topic_map
+
+WORDS = ("data governance quality steward metadata lineage model architecture "
+         "security master reference warehouse integration policy standard "
+         "ownership catalogue privacy retention glossary").split()
+
+
+def _load_script(filename: str, name: str):
+    # The importers are scripts with dashes in their names.
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _sentence(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize()
+
+
+def generate_corpus(questions: int, seed: int = 0) -> Iterator[str]:
+    """Yields lines laid out like the DMBOK practice PDF: chapter headings,
+    a Practice Test marker and question / answer / explanation blocks."""
+
+    rng = random.Random(seed)
+    areas = list(topic_map)
+    per_chapter = max(1, questions // len(areas))
+
+    yield "CDMP Data Management Fundamentals"
+    yield "Practice Test"
+
+    for number in range(1, questions + 1):
+        chapter = min((number - 1) // per_chapter, len(areas) - 1)
+        if (number - 1) % per_chapter == 0 and chapter < len(areas):
+            yield f"Chapter {chapter + 1}"
+            yield ""
+
+        yield f"Question {number}"
+        for _ in range(rng.randint(1, 3)):
+            yield _sentence(rng, 6, 14)
+        yield ""
+        yield "Question Type"
+        answer_count = rng.randint(3, 5)
+        multi = rng.random() < 0.3
+        yield "multi-select" if multi else "multiple-choice"
+
+        for position in range(1, answer_count + 1):
+            yield f"Answer {position}"
+            yield _sentence(rng, 2, 8)
+
+        correct = rng.sample(range(1, answer_count + 1), 2 if multi else 1)
+        yield "Correct Response"
+        yield ",".join(map(str, sorted(correct)))
+        yield "Explanation"
+        yield _sentence(rng, 8, 20)
+        yield "Knowledge Area"
+        yield areas[chapter]
+        yield ""
+
+
+def measure(name: str, parse, lines: list[str]) -> float:
+    started = time.perf_counter()
+    parsed = sum(1 for _ in parse(lines))
+    elapsed = time.perf_counter() - started
+    lines_per_sec = len(lines) / elapsed
+    print(f"{name:<22} {parsed:>8} questions  {elapsed:>7.3f}s  "
+          f"{lines_per_sec:>12,.0f} lines/sec  {parsed / elapsed:>10,.0f} questions/sec")
+    return lines_per_sec
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--write", metavar="PATH",
+                        help="write the corpus to PATH instead of benchmarking")
+    parser.add_argument("--min-lines-per-sec", type=float, default=0)
+    args = parser.parse_args()
+
+    if args.write:
+        with open(args.write, "w", encoding="utf-8") as f:
+            for line in generate_corpus(args.questions, args.seed):
+                f.write(line + "\n")
+        return
+
+    lines = list(generate_corpus(args.questions, args.seed))
+    print(f"{len(lines):,} lines, {args.questions:,} questions")
+
+    book = _load_script("scrape-book.py", "scrape_book")
+    practice = _load_script("scrape-test.py", "scrape_test")
+
+    rates = [
+        measure("scrape-book (all)", book.parse_questions, lines),
+        measure("scrape-test", lambda l: practice.parse_practice_test(l, topic_map), lines),
+    ]
+
+    if args.min_lines_per_sec and min(rates) < args.min_lines_per_sec:
+        print(f"FAIL: below {args.min_lines_per_sec:,.0f} lines/sec")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Fails when a query in connection.py plans a sequential scan of a large table.
+
+    python migrate.py && python benchmarks/plan_check.py --min-rows 10000
+
+Every query passed to cur.execute() in connection.py, whether a literal, a
+module-level constant shared with async_connection.py, or a concatenation
+or f-string of those, is explained as a generic plan (EXPLAIN (GENERIC_PLAN), PostgreSQL 16+), so no parameter
+values are needed and nothing is executed. Run it against a database seeded
+with realistic volumes and ANALYZEd; on a near-empty database the planner
+rightly prefers sequential scans and there is nothing large to flag.
+
+Queries that cannot be resolved statically, and execute_values() calls,
+whose VALUES %s has no generic form, are listed as skipped; --strict fails
+on them too.
+"""
+import argparse
+import ast
+import os
+import re
+import sys
+from typing import Iterator, Optional
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+from connection import get_connection
+
+# Queries that read a whole table on purpose: function -> tables
+ALLOWED_SEQ_SCANS = {
+    "_load_topics": {"topic"},
+    "_load_question_ids": {"question"},
+    "backfill_answer_rollup": {"answer_rollup", "answer_history", "answer", "question"},
+    # The all-users report reads every rollup row by design
+    "get_monthly_accuracy": {"answer_rollup"},
+}
+
+_PARAM = re.compile(r"%\((\w+)\)s|%s")
+_EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+
+def _resolve(node: ast.expr, constants: dict[str, str]) -> Optional[str]:
+    """Returns the string an expression always evaluates to, if it can be
+    worked out from literals and module-level string constants."""
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.Name):
+        return constants.get(node.id)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left = _resolve(node.left, constants)
+        right = _resolve(node.right, constants)
+        return left + right if left is not None and right is not None else None
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.FormattedValue):
+                if value.format_spec is not None or value.conversion != -1:
+                    return None
+                value = value.value
+            part = _resolve(value, constants)
+            if part is None:
+                return None
+            parts.append(part)
+        return "".join(parts)
+    return None
+
+
+def _is_query(node: ast.expr) -> bool:
+    """False for statements such as NOTIFY that are recognisably not
+    explainable even though their text cannot be resolved."""
+
+    if isinstance(node, ast.JoinedStr) and node.values:
+        node = node.values[0]
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value.strip().lower().startswith(_EXPLAINABLE)
+    return True
+
+
+def _loop_bindings(func: ast.FunctionDef, sequences: dict[str, ast.expr],
+                   constants: dict[str, str]) -> dict[str, list[Optional[str]]]:
+    """Maps names bound by `for` loops over module-level lists, such as
+    `for table, statement in _PURGE_STEPS`, to the strings they take."""
+
+    bindings: dict[str, list[Optional[str]]] = {}
+    for node in ast.walk(func):
+        if not (isinstance(node, ast.For) and isinstance(node.iter, ast.Name)
+                and node.iter.id in sequences):
+            continue
+        items = sequences[node.iter.id].elts
+        if isinstance(node.target, ast.Name):
+            bindings[node.target.id] = [_resolve(item, constants) for item in items]
+        elif isinstance(node.target, ast.Tuple):
+            for index, target in enumerate(node.target.elts):
+                if isinstance(target, ast.Name):
+                    bindings[target.id] = [
+                        _resolve(item.elts[index], constants)
+                        if isinstance(item, ast.Tuple) and index < len(item.elts) else None
+                        for item in items]
+    return bindings
+
+
+def find_queries(path: str) -> Iterator[tuple[str, int, Optional[str]]]:
+    """Yields (function, line, sql) for each cur.execute() and
+    execute_values() query in the top-level functions of a module, with sql
+    None when it cannot be explained. Queries in nested functions count
+    towards the function that contains them, and a query taken from a loop
+    over a module-level list is yielded once per item."""
+
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+
+    constants: dict[str, str] = {}
+    sequences: dict[str, ast.expr] = {}
+    for node in tree.body:
+        if isinstance(node, ast.AnnAssign) and node.value is not None:
+            target, value = node.target, node.value
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target, value = node.targets[0], node.value
+        else:
+            continue
+        if not isinstance(target, ast.Name):
+            continue
+        if isinstance(value, (ast.List, ast.Tuple)):
+            sequences[target.id] = value
+        elif (resolved := _resolve(value, constants)) is not None:
+            constants[target.id] = resolved
+
+    for func in tree.body:
+        if not isinstance(func, ast.FunctionDef):
+            continue
+        bindings = _loop_bindings(func, sequences, constants)
+        for node in ast.walk(func):
+            if not isinstance(node, ast.Call):
+                continue
+            name = (node.func.attr if isinstance(node.func, ast.Attribute)
+                    else getattr(node.func, "id", None))
+            if name == "execute" and isinstance(node.func, ast.Attribute) and node.args:
+                arg = node.args[0]
+                if isinstance(arg, ast.Name) and arg.id in bindings:
+                    for sql in bindings[arg.id]:
+                        yield func.name, node.lineno, sql
+                    continue
+                sql = _resolve(arg, constants)
+                if sql is not None or _is_query(arg):
+                    yield func.name, node.lineno, sql
+            elif name == "execute_values" and len(node.args) > 1:
+                yield func.name, node.lineno, None
+
+
+def to_generic(sql: str) -> list[str]:
+    """Rewrites psycopg2 placeholders as $n and splits the explainable
+    statements out of a multi-statement string."""
+
+    numbers: dict[str, int] = {}
+
+    def number(match: re.Match) -> str:
+        key = match.group(1) or f"#{len(numbers)}"
+        numbers.setdefault(key, len(numbers) + 1)
+        return f"${numbers[key]}"
+
+    statements = []
+    for statement in _PARAM.sub(number, sql).split(";"):
+        statement = statement.strip()
+        if statement.lower().startswith(_EXPLAINABLE):
+            statements.append(statement)
+    return statements
+
+
+def seq_scans(plan: dict) -> Iterator[str]:
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", ()):
+        yield from seq_scans(child)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-rows", type=int, default=10_000,
+                        help="tables with at least this many rows count as large")
+    parser.add_argument("--source", default=os.path.join(ROOT, "connection.py"))
+    parser.add_argument("--strict", action="store_true",
+                        help="also fail when a query had to be skipped")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    failures = 0
+    checked = 0
+    skipped = 0
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT relname, reltuples::bigint
+                FROM pg_class
+                WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace;
+            """)
+            sizes = dict(cur.fetchall())
+            large = {table for table, rows in sizes.items() if rows >= args.min_rows}
+            print(f"Large tables (>= {args.min_rows:,} rows): "
+                  f"{', '.join(sorted(large)) or 'none'}")
+
+            for function, line, sql in find_queries(args.source):
+                if sql is None:
+                    skipped += 1
+                    print(f"SKIP {function} (connection.py:{line}): "
+                          f"query cannot be explained statically")
+                    continue
+                for statement in to_generic(sql):
+                    cur.execute(f"EXPLAIN (GENERIC_PLAN, FORMAT JSON) {statement}")
+                    plan = cur.fetchone()[0][0]["Plan"]
+                    checked += 1
+
+                    allowed = ALLOWED_SEQ_SCANS.get(function, set())
+                    for table in seq_scans(plan):
+                        if table in large and table not in allowed:
+                            failures += 1
+                            print(f"FAIL {function} (connection.py:{line}): "
+                                  f"Seq Scan on {table} (~{sizes[table]:,} rows)")
+        conn.rollback()
+    finally:
+        conn.close()
+
+    print(f"Checked {checked} statements, {failures} sequential scan(s) on large tables, "
+          f"{skipped} query(ies) skipped")
+    if failures or (args.strict and skipped):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
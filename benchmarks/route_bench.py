@@ -0,0 +1,226 @@
+"""Drives the app's routes with concurrent simulated users and reports
+latency percentiles, throughput and database queries per request.
+
+    python benchmarks/seed_bench.py
+    python benchmarks/route_bench.py --workers 16 --duration 60 --save before
+    python benchmarks/route_bench.py --workers 16 --duration 60 --compare before
+
+Each worker is a Flask test client logged in as one of the seeded
+bench-user-N accounts. It loops through home -> topic -> practice question
+-> practice answer, and every --exam-every iterations sets up, takes,
+submits and views an exam. Requests run in-process on worker threads, so
+the numbers include Python overhead but no HTTP stack.
+
+Baselines are saved as JSON under benchmarks/baselines/. With --compare,
+the script exits non-zero when a route's p95 latency grows by more than
+--max-regression percent or it issues more queries per request than before.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+import connection
+from seed_bench import PASSWORD, TOPIC_PREFIX, USER_PREFIX
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+_EXAM_CHOICE = re.compile(rb'name="question_(\d+)\[\]"\s+value="(\d+)"')
+
+# The app reports each request's query count in its Server-Timing header.
+_QUERY_COUNT = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[tuple[float, int]]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def call(self, route: str, fn: Callable, *args: Any, **kwargs: Any):
+        started = time.perf_counter()
+        response = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        match = _QUERY_COUNT.search(response.headers.get("Server-Timing", ""))
+        queries = int(match.group(1)) if match else 0
+        with self._lock:
+            self.samples[route].append((elapsed, queries))
+            if response.status_code >= 400:
+                self.errors[route] += 1
+        return response
+
+    def summary(self, seconds: float) -> dict[str, Any]:
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            latencies = [s[0] * 1000 for s in samples]
+            routes[route] = {
+                "requests": len(samples),
+                "errors": self.errors[route],
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "queries_per_request": sum(s[1] for s in samples) / len(samples),
+            }
+        total = sum(r["requests"] for r in routes.values())
+        return {"seconds": seconds, "requests": total,
+                "requests_per_second": total / seconds if seconds else 0.0,
+                "routes": routes}
+
+
+def load_questions(limit: int = 1000) -> list[tuple[int, int, list[int]]]:
+    with connection.pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT q.topic_id, q.question_id, array_agg(a.answer_id)
+            FROM question q
+            JOIN topic t ON t.topic_id = q.topic_id
+            JOIN answer a ON a.question_id = q.question_id
+            WHERE t.topic_name LIKE %s AND t.hidden_at IS NULL
+            GROUP BY q.topic_id, q.question_id
+            ORDER BY random()
+            LIMIT %s;
+        """, (TOPIC_PREFIX + "%", limit))
+        return cur.fetchall()
+
+
+def run_worker(app, index: int, args: argparse.Namespace,
+               questions: list[tuple[int, int, list[int]]],
+               recorder: Recorder, deadline: float) -> None:
+    client = app.test_client()
+    rng = random.Random(index)
+    login = {"username": f"{USER_PREFIX}{index % args.users + 1}",
+             "password": args.password}
+
+    iteration = 0
+    while time.monotonic() < deadline:
+        if iteration % args.login_every == 0:
+            recorder.call("POST /login", client.post, "/login", data=login)
+
+        topic_id, question_id, answer_ids = rng.choice(questions)
+        recorder.call("GET /", client.get, "/")
+        recorder.call("GET /topics/<id>", client.get, f"/topics/{topic_id}")
+        recorder.call("GET /topics/<id>/test", client.get, f"/topics/{topic_id}/test")
+        recorder.call("POST /topics/<id>/test/submit", client.post,
+                      f"/topics/{topic_id}/test/submit",
+                      data={"question_id": question_id,
+                            "selected_answers": [rng.choice(answer_ids)]})
+
+        if iteration % args.exam_every == 0:
+            response = recorder.call("POST /exam/setup", client.post, "/exam/setup",
+                                     data={"num_questions": args.exam_size,
+                                           "duration": 60})
+            exam_path = response.headers.get("Location", "")
+            if exam_path.startswith("/exam/"):
+                page = recorder.call("GET /exam/<id>", client.get, exam_path)
+                choices: dict[str, list[str]] = defaultdict(list)
+                for q, a in _EXAM_CHOICE.findall(page.data):
+                    if rng.random() < 0.4:
+                        choices[f"question_{q.decode()}[]"].append(a.decode())
+                recorder.call("POST /exam/<id>", client.post, exam_path, data=choices)
+                recorder.call("GET /exam/<id>/result", client.get, f"{exam_path}/result")
+
+        iteration += 1
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any],
+            max_regression: float) -> bool:
+    ok = True
+    print(f"\n{'route':<32} {'p95 before':>11} {'p95 now':>9} {'change':>8} "
+          f"{'q/req before':>13} {'q/req now':>10}")
+    for route, now in current["routes"].items():
+        before = baseline["routes"].get(route)
+        if before is None:
+            print(f"{route:<32} {'-':>11} {now['p95_ms']:>9.1f}")
+            continue
+        change = (100 * (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"]
+                  if before["p95_ms"] else 0.0)
+        more_queries = now["queries_per_request"] > before["queries_per_request"] + 0.01
+        flag = ""
+        if change > max_regression or more_queries:
+            ok = False
+            flag = "  REGRESSION"
+        print(f"{route:<32} {before['p95_ms']:>11.1f} {now['p95_ms']:>9.1f} "
+              f"{change:>+7.0f}% {before['queries_per_request']:>13.2f} "
+              f"{now['queries_per_request']:>10.2f}{flag}")
+    print(f"throughput: {baseline['requests_per_second']:,.1f} -> "
+          f"{current['requests_per_second']:,.1f} req/s")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--users", type=int, default=500,
+                        help="number of seeded bench users to log in as")
+    parser.add_argument("--password", default=PASSWORD)
+    parser.add_argument("--login-every", type=int, default=25)
+    parser.add_argument("--exam-every", type=int, default=10)
+    parser.add_argument("--exam-size", type=int, default=50)
+    parser.add_argument("--save", metavar="NAME", help="save results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare with a saved baseline")
+    parser.add_argument("--max-regression", type=float, default=20,
+                        help="allowed p95 growth in percent when comparing")
+    args = parser.parse_args()
+
+    from main import app
+
+    questions = load_questions()
+    if not questions:
+        sys.exit("No benchmark data found; run benchmarks/seed_bench.py first")
+
+    # Warm the caches and the pool outside the measured window.
+    warm = app.test_client()
+    warm.get("/")
+    warm.get(f"/topics/{questions[0][0]}/test")
+
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=run_worker,
+                                args=(app, i, args, questions, recorder, deadline))
+               for i in range(args.workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = recorder.summary(time.monotonic() - started)
+    result["config"] = {k: v for k, v in vars(args).items()
+                        if k not in ("save", "compare", "password")}
+
+    print(f"{'route':<32} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'q/req':>6}")
+    for route, r in result["routes"].items():
+        print(f"{route:<32} {r['requests']:>9} {r['errors']:>7} {r['p50_ms']:>8.1f} "
+              f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['queries_per_request']:>6.2f}")
+    print(f"{result['requests']:,} requests in {result['seconds']:.1f}s, "
+          f"{result['requests_per_second']:,.1f} req/s with {args.workers} workers")
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.save}.json"), "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Compares QuestionSampler against an ORDER BY RANDOM() style full sort as
+the question bank grows.
+
+    python benchmarks/sampler_bench.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sampler import QuestionSampler
+
+
+def make_bank(size: int, topics: int) -> list[tuple[int, int]]:
+    return [(question_id % topics, question_id) for question_id in range(size)]
+
+
+def sort_sample(bank: list[tuple[int, int]], k: int) -> list[int]:
+    # What ORDER BY RANDOM() LIMIT k does: a random key per row, then a sort.
+    keyed = sorted(bank, key=lambda _: random.random())
+    return [question_id for _, question_id in keyed[:k]]
+
+
+def timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--topics", type=int, default=17)
+    parser.add_argument("--k", type=int, default=50, help="exam size")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'bank size':>10} {'sort ms':>10} {'topic ms':>10} "
+          f"{'uniform ms':>11} {'stratified ms':>14}")
+
+    for size in args.sizes:
+        bank = make_bank(size, args.topics)
+        sampler = QuestionSampler(lambda: bank)
+        sampler.count()  # load outside the timed section
+
+        sort_ms = timed(lambda: sort_sample(bank, args.k), max(1, args.repeat // 10))
+        topic_ms = timed(lambda: sampler.sample_topic(0), args.repeat)
+        uniform_ms = timed(lambda: sampler.sample(args.k), args.repeat)
+        stratified_ms = timed(lambda: sampler.sample_stratified(args.k), args.repeat)
+
+        print(f"{size:>10} {sort_ms:>10.3f} {topic_ms:>10.4f} "
+              f"{uniform_ms:>11.4f} {stratified_ms:>14.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Seeds the database with a synthetic question bank and usage history.
+
+    python migrate.py
+    python benchmarks/seed_bench.py --topics 20 --questions 2500 --history 5000000
+    python benchmarks/seed_bench.py --drop
+
+Everything is generated server-side with generate_series, so millions of
+answer_history rows load in seconds. Seeded topics are named bench-topic-N
+and users bench-user-N; all users share the password given by --password,
+for route_bench.py to log in with. Point the app at a scratch database: the
+rows live alongside real data until --drop removes them.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash
+
+from auth import password_method
+from connection import (backfill_answer_rollup, get_connection, pooled_connection,
+                        purge_topic)
+
+TOPIC_PREFIX = "bench-topic-"
+USER_PREFIX = "bench-user-"
+PASSWORD = "benchmark"
+
+
+def step(label: str):
+    started = time.perf_counter()
+    print(f"{label}...", end=" ", flush=True)
+    return lambda rows: print(f"{rows:,} rows in {time.perf_counter() - started:.1f}s")
+
+
+def seed(args: argparse.Namespace) -> None:
+    # Hash with the app's settings so logins don't trigger a rehash.
+    iterations = int(os.environ.get("PASSWORD_HASH_ITERATIONS", DEFAULT_PBKDF2_ITERATIONS))
+    password_hash = generate_password_hash(args.password, password_method(iterations), 16)
+
+    with pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM topic WHERE topic_name LIKE %s;",
+                    (TOPIC_PREFIX + "%",))
+        if cur.fetchone()[0]:
+            sys.exit("Benchmark data is already loaded; run with --drop first")
+
+        done = step("Topics")
+        cur.execute("""
+            INSERT INTO topic (topic_name)
+            SELECT %(prefix)s || i
+            FROM generate_series(1, %(topics)s) i
+            RETURNING topic_id;
+        """, {"prefix": TOPIC_PREFIX, "topics": args.topics})
+        topic_ids = [r[0] for r in cur.fetchall()]
+        done(len(topic_ids))
+
+        done = step("Questions")
+        cur.execute("""
+            INSERT INTO question (topic_id, question_text, contextual_info)
+            SELECT t.topic_id,
+                   'Benchmark question ' || t.topic_id || '.' || n
+                       || ': which practice best supports data governance?',
+                   'Synthetic explanation for question ' || n || '.'
+            FROM unnest(%(topic_ids)s::int[]) AS t(topic_id),
+                 generate_series(1, %(questions)s) n;
+        """, {"topic_ids": topic_ids, "questions": args.questions})
+        done(cur.rowcount)
+
+        done = step("Answers")
+        cur.execute("""
+            INSERT INTO answer (question_id, answer_text, is_correct)
+            SELECT q.question_id, 'Answer option ' || n, n = 1
+            FROM question q, generate_series(1, %(answers)s) n
+            WHERE q.topic_id = ANY(%(topic_ids)s)
+            ORDER BY q.question_id, n;
+        """, {"topic_ids": topic_ids, "answers": args.answers})
+        done(cur.rowcount)
+
+        done = step("Users")
+        cur.execute("""
+            INSERT INTO users (username, password_hash)
+            SELECT %(prefix)s || i, %(hash)s
+            FROM generate_series(1, %(users)s) i
+            ON CONFLICT (username) DO UPDATE SET password_hash = EXCLUDED.password_hash;
+        """, {"prefix": USER_PREFIX, "users": args.users, "hash": password_hash})
+        done(cur.rowcount)
+
+    # History goes in chunks, one transaction each, to keep WAL and locks small.
+    done = step("Answer history")
+    remaining = args.history
+    while remaining > 0:
+        chunk = min(remaining, args.chunk)
+        with pooled_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO answer_history (answer_time, answer_id, user_id)
+                SELECT now() - random() * interval '365 days',
+                       a.ids[1 + floor(random() * a.n)::int],
+                       u.ids[1 + floor(random() * u.n)::int]
+                FROM (SELECT array_agg(answer_id) AS ids, count(*) AS n
+                      FROM answer
+                      JOIN question USING (question_id)
+                      JOIN topic USING (topic_id)
+                      WHERE topic_name LIKE %(topics)s) a,
+                     (SELECT array_agg(user_id) AS ids, count(*) AS n
+                      FROM users
+                      WHERE username LIKE %(users)s) u,
+                     generate_series(1, %(chunk)s);
+            """, {"topics": TOPIC_PREFIX + "%", "users": USER_PREFIX + "%",
+                  "chunk": chunk})
+        remaining -= chunk
+    done(args.history)
+
+    with pooled_connection() as conn, conn.cursor() as cur:
+        done = step("Exams")
+        cur.execute("""
+            WITH bench_users AS (
+                SELECT array_agg(user_id) AS ids, count(*) AS n
+                FROM users WHERE username LIKE %(users)s
+            ),
+            bench_questions AS (
+                SELECT array_agg(question_id) AS ids, count(*) AS n
+                FROM question JOIN topic USING (topic_id)
+                WHERE topic_name LIKE %(topics)s
+            ),
+            exams AS (
+                INSERT INTO exam (user_id, start_time, total_questions, duration_minutes)
+                SELECT u.ids[1 + floor(random() * u.n)::int],
+                       now() - random() * interval '90 days',
+                       %(size)s, 60
+                FROM bench_users u, generate_series(1, %(exams)s)
+                RETURNING exam_id
+            )
+            INSERT INTO exam_question (exam_id, question_id, position)
+            SELECT e.exam_id, q.ids[1 + floor(random() * q.n)::int], p - 1
+            FROM exams e, bench_questions q, generate_series(1, %(size)s) p;
+        """, {"users": USER_PREFIX + "%", "topics": TOPIC_PREFIX + "%",
+              "exams": args.exams, "size": args.exam_size})
+        done(cur.rowcount)
+
+    done = step("Answer rollup")
+    done(backfill_answer_rollup())
+
+    done = step("ANALYZE")
+    conn = get_connection()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE;")
+    finally:
+        conn.close()
+    done(0)
+
+
+def drop() -> None:
+    """Removes seeded topics (through the batched purge) and users."""
+
+    with pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE topic SET hidden_at = now()
+            WHERE topic_name LIKE %s AND hidden_at IS NULL
+            RETURNING topic_id;
+        """, (TOPIC_PREFIX + "%",))
+        topic_ids = [r[0] for r in cur.fetchall()]
+
+    for topic_id in topic_ids:
+        progress = purge_topic(topic_id, batch_size=50_000, pause=0)
+        print(f"Purged topic {topic_id}: {progress['deleted']}")
+
+    with pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE bench_users ON COMMIT DROP AS
+            SELECT user_id FROM users WHERE username LIKE %s;
+
+            CREATE TEMP TABLE bench_exams ON COMMIT DROP AS
+            SELECT exam_id FROM exam WHERE user_id IN (SELECT user_id FROM bench_users);
+
+            DELETE FROM exam_result WHERE exam_id IN (SELECT exam_id FROM bench_exams);
+            DELETE FROM exam_answer WHERE exam_id IN (SELECT exam_id FROM bench_exams);
+            DELETE FROM exam_question WHERE exam_id IN (SELECT exam_id FROM bench_exams);
+            DELETE FROM exam WHERE exam_id IN (SELECT exam_id FROM bench_exams);
+            DELETE FROM answer_history WHERE user_id IN (SELECT user_id FROM bench_users);
+            DELETE FROM answer_rollup WHERE user_id IN (SELECT user_id FROM bench_users);
+            DELETE FROM question_mastery WHERE user_id IN (SELECT user_id FROM bench_users);
+            DELETE FROM users WHERE user_id IN (SELECT user_id FROM bench_users);
+        """, (USER_PREFIX + "%",))
+    print(f"Removed {len(topic_ids)} topics and the {USER_PREFIX}* users")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--topics", type=int, default=17)
+    parser.add_argument("--questions", type=int, default=1_000, help="per topic")
+    parser.add_argument("--answers", type=int, default=4, help="per question")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--history", type=int, default=1_000_000,
+                        help="answer_history rows")
+    parser.add_argument("--exams", type=int, default=5_000)
+    parser.add_argument("--exam-size", type=int, default=50)
+    parser.add_argument("--chunk", type=int, default=500_000,
+                        help="answer_history rows per transaction")
+    parser.add_argument("--password", default=PASSWORD)
+    parser.add_argument("--drop", action="store_true",
+                        help="remove previously seeded data instead")
+    args = parser.parse_args()
+
+    if args.drop:
+        drop()
+    else:
+        seed(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import io
+from typing import Any, Iterable, Optional, Sequence
+
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+# Above this many rows a plain insert switches to COPY. COPY cannot return
+# generated ids, so inserts with RETURNING always use multi-row VALUES.
+COPY_THRESHOLD = 1000
+
+
+def _copy_value(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+
+def copy_rows(cur, table: str, columns: Sequence[str],
+              rows: Iterable[Sequence[Any]]) -> None:
+    """Streams rows into a table with COPY ... FROM STDIN."""
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(v) for v in row))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    statement = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, columns)))
+    cur.copy_expert(statement.as_string(cur), buffer)
+
+
+def insert_rows(cur, table: str, columns: Sequence[str],
+                rows: Sequence[Sequence[Any]],
+                returning: Optional[Sequence[str]] = None,
+                page_size: int = 500) -> list[tuple]:
+    """Inserts many rows with a single statement per page.
+
+    Uses multi-row VALUES for small batches, and whenever `returning` is
+    given, and COPY for large ones.
+    """
+
+    if not rows:
+        return []
+
+    if returning is None and len(rows) >= COPY_THRESHOLD:
+        copy_rows(cur, table, columns, rows)
+        return []
+
+    statement = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, columns)))
+    if returning:
+        statement += sql.SQL(" RETURNING {}").format(
+            sql.SQL(", ").join(map(sql.Identifier, returning)))
+
+    result = execute_values(cur, statement.as_string(cur), rows,
+                            page_size=page_size, fetch=bool(returning))
+    return result or []
@@ -0,0 +1,183 @@
+import hashlib
+import select
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import psycopg2
+
+# Channel used to tell other processes (e.g. the importers) that the topic
+# table changed and their cached catalog is stale.
+TOPIC_CHANNEL = "topic_catalog"
+
+
+class LRUCache:
+    """Small thread-safe least-recently-used cache for values that never go
+    stale, such as the results of finished exams."""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Optional[Any]:
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._items[key]
+
+    def put(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def discard(self, key: Any) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class TopicCatalog:
+    """In-process cache of the topic table, keyed by topic_id and kept in
+    display order for the home page.
+
+    Topics carry a `version` that is bumped whenever the topic or its
+    questions change; fingerprint() summarises all of them so the home page
+    can tell whether anything changed without a query."""
+
+    def __init__(self, load: Callable[[], list[dict[str, Any]]], ttl: float = 300.0):
+        self._load = load
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_id: dict[int, dict[str, Any]] = {}
+        self._ordered: list[dict[str, Any]] = []
+        self._fingerprint = ""
+        self._loaded_at: Optional[float] = None
+        self._populated = False
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _fresh(self) -> bool:
+        return (self._loaded_at is not None
+                and time.monotonic() - self._loaded_at < self.ttl)
+
+    def _ensure_loaded(self) -> None:
+        with self._lock:
+            if self._fresh():
+                self.hits += 1
+                return
+            self.misses += 1
+            generation = self._generation
+
+        topics = self._load()
+
+        with self._lock:
+            # A load that raced an invalidation may predate the change. It
+            # must not replace what is there, but it beats an empty catalog
+            # (as at startup, when the listener invalidates on connect);
+            # either way the catalog stays stale and the next call reloads.
+            current = generation == self._generation
+            if not current and self._populated:
+                return
+            self._ordered = topics
+            self._by_id = {t["topic_id"]: t for t in topics}
+            self._fingerprint = hashlib.sha1(repr(
+                [(t["topic_id"], t.get("version")) for t in topics]
+            ).encode()).hexdigest()[:16]
+            self._populated = True
+            if current:
+                self._loaded_at = time.monotonic()
+
+    def all(self) -> list[dict[str, Any]]:
+        self._ensure_loaded()
+        return list(self._ordered)
+
+    def get(self, topic_id: int) -> Optional[dict[str, Any]]:
+        self._ensure_loaded()
+        return self._by_id.get(topic_id)
+
+    def fingerprint(self) -> str:
+        self._ensure_loaded()
+        return self._fingerprint
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = None
+            self.invalidations += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "topics": len(self._ordered),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "age_seconds": (time.monotonic() - self._loaded_at
+                                if self._loaded_at is not None else None),
+            }
+
+    def listen(self, connect: Callable[[], psycopg2.extensions.connection],
+               channel: str = TOPIC_CHANNEL,
+               on_notify: Optional[Callable[[Optional[str]], None]] = None
+               ) -> threading.Thread:
+        """Starts a daemon thread that invalidates the catalog whenever a
+        NOTIFY arrives on `channel`. If the listener connection drops, the
+        catalog falls back to its TTL until it reconnects.
+
+        `on_notify` is called with each notification's payload, and with
+        None after (re)connecting, when notifications may have been missed."""
+
+        def run() -> None:
+            while True:
+                conn = None
+                try:
+                    conn = connect()
+                    conn.set_isolation_level(
+                        psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                    with conn.cursor() as cur:
+                        cur.execute(f"LISTEN {channel};")
+                    # Anything may have changed while we were not listening.
+                    self.invalidate()
+                    if on_notify:
+                        on_notify(None)
+                    while True:
+                        if select.select([conn], [], [], 60) == ([], [], []):
+                            continue
+                        conn.poll()
+                        if conn.notifies:
+                            payloads = [n.payload for n in conn.notifies]
+                            conn.notifies.clear()
+                            self.invalidate()
+                            if on_notify:
+                                for payload in payloads:
+                                    on_notify(payload)
+                except psycopg2.Error:
+                    time.sleep(min(self.ttl, 30))
+                finally:
+                    if conn is not None:
+                        conn.close()
+
+        thread = threading.Thread(target=run, name="topic-catalog-listener",
+                                  daemon=True)
+        thread.start()
+        return thread
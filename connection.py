@@ -1,86 +1,449 @@
+import atexit
+import logging
+import threading
+import time
 import psycopg2
-from typing import Optional, Any
-from werkzeug.security import check_password_hash
-from flask import request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import partial
+from os import environ as env
+from typing import Optional, Any, Callable, Iterator, TypeVar
+from dotenv import load_dotenv
+from flask import g, has_app_context
+from psycopg2.extras import execute_values
 
-def get_connection() -> psycopg2.extensions.connection:
-    """Establishes and returns a connection to the PostgreSQL database."""
+from bulk import insert_rows
+from cache import LRUCache, TopicCatalog, TOPIC_CHANNEL
+from history_writer import BufferedWriter
+from pool import ConnectionPool, PoolTimeout
+from querylog import InstrumentedCursor, query_log
+from replicas import ReplicaSet
+from sampler import QuestionSampler
 
-    return psycopg2.connect(
-        dbname="revisor",
-        user="RuneTek",
-        host="localhost")
+logger = logging.getLogger(__name__)
 
-def get_all_topics():
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT topic_id, topic_name FROM topic;")
+T = TypeVar("T")
+
+load_dotenv()
+
+# libpq connection strings or URLs. Replicas are comma-separated; without
+# any, every query goes to the primary.
+DATABASE_URL = env.get("DATABASE_URL", "dbname=revisor user=RuneTek host=localhost")
+DATABASE_REPLICA_URLS = [dsn.strip() for dsn in env.get("DATABASE_REPLICA_URLS", "").split(",")
+                         if dsn.strip()]
+
+# A replica that does not answer should cost a read seconds, not the OS's
+# TCP timeout; a busy one should spill reads to the primary quickly.
+REPLICA_CONNECT_TIMEOUT = int(env.get("REPLICA_CONNECT_TIMEOUT", 2))
+REPLICA_POOL_TIMEOUT = float(env.get("REPLICA_POOL_TIMEOUT", 0.5))
+
+def get_connection(dsn: str = DATABASE_URL, **kwargs: Any) -> psycopg2.extensions.connection:
+    """Establishes and returns a connection to the PostgreSQL database,
+    the primary unless `dsn` names another server."""
+
+    return psycopg2.connect(dsn, cursor_factory=InstrumentedCursor, **kwargs)
+
+query_log.slow_ms = float(env.get("SLOW_QUERY_MS", 200))
+query_log.repeat_warning = int(env.get("QUERY_REPEAT_WARNING", 10))
+
+_pool = ConnectionPool(
+    get_connection,
+    min_size=int(env.get("DB_POOL_MIN", 1)),
+    max_size=int(env.get("DB_POOL_MAX", 10)),
+    timeout=float(env.get("DB_POOL_TIMEOUT", 5)),
+    max_idle=float(env.get("DB_POOL_MAX_IDLE", 30)))
+atexit.register(_pool.close)
+
+_replicas = ReplicaSet(
+    DATABASE_REPLICA_URLS, DATABASE_URL,
+    lambda dsn: psycopg2.connect(dsn, connect_timeout=REPLICA_CONNECT_TIMEOUT),
+    max_lag=float(env.get("REPLICA_MAX_LAG", 1)),
+    interval=float(env.get("REPLICA_CHECK_INTERVAL", 1)))
+
+_replica_pools = {
+    dsn: ConnectionPool(
+        partial(get_connection, dsn, connect_timeout=REPLICA_CONNECT_TIMEOUT),
+        min_size=int(env.get("DB_POOL_MIN", 1)),
+        max_size=int(env.get("DB_POOL_MAX", 10)),
+        timeout=REPLICA_POOL_TIMEOUT,
+        max_idle=float(env.get("DB_POOL_MAX_IDLE", 30)))
+    for dsn in DATABASE_REPLICA_URLS
+}
+for _replica_pool in _replica_pools.values():
+    atexit.register(_replica_pool.close)
+
+_primary_reads: ContextVar[bool] = ContextVar("primary_reads", default=False)
+
+@contextmanager
+def pooled_connection() -> Iterator[psycopg2.extensions.connection]:
+    """Checks out a pooled connection, committing when the block exits
+    cleanly and rolling back otherwise."""
+
+    started = time.perf_counter()
+    with _pool.connection() as conn:
+        query_log.record_checkout(time.perf_counter() - started)
+        yield conn
+
+def fill_pools():
+    """Opens each pool's DB_POOL_MIN connections so the first requests do
+    not pay for connecting. A database that is down is logged and left to
+    the pools to connect on demand."""
+
+    for pool in (_pool, *_replica_pools.values()):
+        try:
+            pool.fill()
+        except psycopg2.OperationalError as e:
+            logger.warning("Could not pre-open pool connections: %s", e)
+
+def start_replica_monitor():
+    """Starts polling the replicas; until then reads go to the primary."""
+
+    _replicas.start()
+
+def has_replicas() -> bool:
+    return bool(_replicas)
+
+def read_from_primary(enabled: bool = True):
+    """Sends the current request's reads to the primary, e.g. because the
+    user has just written and a replica may not have their change yet."""
+
+    _primary_reads.set(enabled)
+
+def _read_target(fresh_since: Optional[datetime] = None) -> Optional[str]:
+    """The replica DSN a read should use, or None for the primary."""
+
+    if _primary_reads.get():
+        return None
+    return _replicas.choose(fresh_since)
+
+def read_query(work: Callable[[psycopg2.extensions.cursor], T],
+               fresh_since: Optional[datetime] = None) -> T:
+    """Runs read-only `work` with a cursor on a replica that is keeping up
+    (and has replayed everything up to `fresh_since`) when there is one,
+    else on the primary.
+
+    If the replica cannot be reached, or its connection fails while `work`
+    runs, it is taken out of rotation and `work` runs again on the primary.
+    A replica whose pool is merely busy stays in rotation; that one read
+    goes to the primary."""
+
+    dsn = _read_target(fresh_since)
+    if dsn is not None:
+        started = time.perf_counter()
+        try:
+            with _replica_pools[dsn].connection() as conn, conn.cursor() as cur:
+                query_log.record_checkout(time.perf_counter() - started)
+                return work(cur)
+        except PoolTimeout:
+            _replicas.mark_busy(dsn)
+        except psycopg2.OperationalError as e:
+            logger.warning("Replica read failed, using primary: %s", e)
+            _replicas.mark_down(dsn, e)
+
+    with pooled_connection() as conn, conn.cursor() as cur:
+        return work(cur)
+
+def get_pool_stats() -> dict[str, Any]:
+    return _pool.stats()
+
+def get_replica_stats() -> dict[str, Any]:
+    return _replicas.stats()
+
+# The catalog and the sampler load from the primary: a reload prompted by a
+# NOTIFY can run before the replicas have the change, and what it loads is
+# cached for the whole process.
+def _load_topics() -> list[dict[str, Any]]:
+    with pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT topic_id, topic_name, version, updated_at
+            FROM topic
+            WHERE hidden_at IS NULL
+            ORDER BY topic_id;
+        """)
         topics = cur.fetchall()
-    conn.close()
-    return [{"topic_id": t[0], "topic_name": t[1]} for t in topics]
+    return [{"topic_id": t[0], "topic_name": t[1], "version": t[2], "updated_at": t[3]}
+            for t in topics]
+
+_topics = TopicCatalog(_load_topics, ttl=float(env.get("TOPIC_CACHE_TTL", 300)))
+
+# Payload of the NOTIFY sent when a topic is hidden, so every process
+# stops sampling its questions, not just the one that hid it. A NOTIFY
+# without a payload (topics or questions added or edited, here or by the
+# importers) reloads the sampler, as does reconnecting the listener.
+_TOPIC_HIDDEN = "hidden:"
+
+def _on_topic_notify(payload: Optional[str]) -> None:
+    if payload and payload.startswith(_TOPIC_HIDDEN):
+        _sampler.drop_topic(int(payload[len(_TOPIC_HIDDEN):]))
+    else:
+        _sampler.invalidate()
+
+def start_topic_listener():
+    """Invalidates the topic cache, and drops hidden topics from the
+    question sampler, when another process changes topics."""
+
+    _topics.listen(get_connection, on_notify=_on_topic_notify)
+
+def get_topic_cache_stats() -> dict[str, Any]:
+    return _topics.stats()
+
+def _load_question_ids() -> list[tuple[int, int]]:
+    with pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT q.topic_id, q.question_id
+            FROM question q
+            JOIN topic t ON t.topic_id = q.topic_id
+            WHERE t.hidden_at IS NULL;
+        """)
+        return cur.fetchall()
+
+_sampler = QuestionSampler(_load_question_ids,
+                           ttl=float(env.get("SAMPLER_TTL", 600)))
+
+def get_all_topics():
+    return _topics.all()
+
+def get_topic_catalog_version() -> str:
+    """Changes whenever a topic is created or deleted or its questions change."""
+    return _topics.fingerprint()
+
+def _bump_topic_version(cur, topic_id: int):
+    """Marks a topic's pages as changed. Takes effect for other processes
+    when the transaction commits; callers invalidate the local catalog."""
+
+    cur.execute("""
+        UPDATE topic
+        SET version = version + 1, updated_at = now()
+        WHERE topic_id = %s;
+    """, (topic_id,))
+    cur.execute(f"NOTIFY {TOPIC_CHANNEL};")
 
 def create_topic_in_db(topic_name: str):
-    conn = get_connection()
-    with conn.cursor() as cur:
+    with pooled_connection() as conn, conn.cursor() as cur:
         cur.execute(
             "INSERT INTO topic (topic_name) VALUES (%s);",
             (topic_name,))
-    conn.commit()
-    conn.close()
+        cur.execute(f"NOTIFY {TOPIC_CHANNEL};")
+    _topics.invalidate()
 
-def delete_topic_from_db(topic_id: int):
-    conn = get_connection()
-    with conn.cursor() as cur:
-        # 1️⃣ Delete answers first
-        cur.execute(
-            """
-            DELETE FROM answer
-            WHERE question_id IN (
-                SELECT question_id FROM question WHERE topic_id = %s
-            );
-            """,
-            (topic_id,)
-        )
+PURGE_BATCH_SIZE = int(env.get("PURGE_BATCH_SIZE", 1000))
+PURGE_PAUSE = float(env.get("PURGE_PAUSE", 0.05))
 
-        # 2️⃣ Delete questions
-        cur.execute(
-            "DELETE FROM question WHERE topic_id = %s;",
-            (topic_id,)
-        )
+# Everything that references a topic's questions, in the order it has to
+# go. Each statement deletes at most %(limit)s rows and is repeated until
+# it deletes nothing. Rows are found from the topic's question (and answer)
+# ids through the foreign key indexes, gathered with ARRAY() so the planner
+# probes those indexes rather than hash joining against whole tables.
+_PURGE_STEPS = [
+    ("answer_history", """
+        DELETE FROM answer_history
+        WHERE answer_history_id = ANY(ARRAY(
+            SELECT answer_history_id
+            FROM answer_history
+            WHERE answer_id = ANY(ARRAY(
+                SELECT answer_id
+                FROM answer
+                WHERE question_id = ANY(ARRAY(
+                    SELECT question_id FROM question WHERE topic_id = %(topic_id)s))))
+            LIMIT %(limit)s));
+    """),
+    ("exam_answer", """
+        DELETE FROM exam_answer
+        WHERE exam_answer_id = ANY(ARRAY(
+            SELECT exam_answer_id
+            FROM exam_answer
+            WHERE question_id = ANY(ARRAY(
+                SELECT question_id FROM question WHERE topic_id = %(topic_id)s))
+            LIMIT %(limit)s));
+    """),
+    ("exam_question", """
+        DELETE FROM exam_question
+        WHERE exam_question_id = ANY(ARRAY(
+            SELECT exam_question_id
+            FROM exam_question
+            WHERE question_id = ANY(ARRAY(
+                SELECT question_id FROM question WHERE topic_id = %(topic_id)s))
+            LIMIT %(limit)s));
+    """),
+    ("question_mastery", """
+        DELETE FROM question_mastery
+        WHERE (user_id, question_id) IN (
+            SELECT user_id, question_id
+            FROM question_mastery
+            WHERE topic_id = %(topic_id)s
+            LIMIT %(limit)s);
+    """),
+    ("answer_rollup", """
+        DELETE FROM answer_rollup
+        WHERE (month, topic_id, user_id) IN (
+            SELECT month, topic_id, user_id
+            FROM answer_rollup
+            WHERE topic_id = %(topic_id)s
+            LIMIT %(limit)s);
+    """),
+    ("answer", """
+        DELETE FROM answer
+        WHERE answer_id = ANY(ARRAY(
+            SELECT answer_id
+            FROM answer
+            WHERE question_id = ANY(ARRAY(
+                SELECT question_id FROM question WHERE topic_id = %(topic_id)s))
+            LIMIT %(limit)s));
+    """),
+    ("question", """
+        DELETE FROM question
+        WHERE question_id = ANY(ARRAY(
+            SELECT question_id
+            FROM question
+            WHERE topic_id = %(topic_id)s
+            LIMIT %(limit)s));
+    """),
+]
 
-        # 3️⃣ Delete the topic
-        cur.execute(
-            "DELETE FROM topic WHERE topic_id = %s;",
-            (topic_id,)
-        )
+_purges: dict[int, dict[str, Any]] = {}
+_purges_lock = threading.Lock()
+
+def delete_topic_from_db(topic_id: int) -> bool:
+    """Hides a topic straight away and purges its data in the background.
+    Returns False if the topic was already deleted."""
+
+    with pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE topic
+            SET hidden_at = now(), version = version + 1, updated_at = now()
+            WHERE topic_id = %s AND hidden_at IS NULL;
+        """, (topic_id,))
+        hidden = cur.rowcount == 1
+        if hidden:
+            cur.execute("SELECT pg_notify(%s, %s);",
+                        (TOPIC_CHANNEL, f"{_TOPIC_HIDDEN}{topic_id}"))
 
-    conn.commit()
-    conn.close()
+    if not hidden:
+        return False
+
+    _topics.invalidate()
+    _sampler.drop_topic(topic_id)
+    threading.Thread(target=purge_topic, args=(topic_id,),
+                     name=f"topic-purge-{topic_id}", daemon=True).start()
+    return True
+
+def purge_topic(topic_id: int, batch_size: int = PURGE_BATCH_SIZE,
+                pause: float = PURGE_PAUSE) -> dict[str, Any]:
+    """Deletes a hidden topic and everything that references it in batches
+    of `batch_size` rows, one short transaction per batch, pausing between
+    batches so live traffic keeps its share of the database. Safe to re-run
+    after an interruption."""
+
+    progress = {
+        "topic_id": topic_id,
+        "stage": None,
+        "deleted": {},
+        "started_at": datetime.now(timezone.utc),
+        "finished_at": None,
+        "error": None,
+    }
+    with _purges_lock:
+        running = _purges.get(topic_id)
+        if running and running["finished_at"] is None:
+            return running
+        _purges[topic_id] = progress
+
+    try:
+        for table, statement in _PURGE_STEPS:
+            progress["stage"] = table
+            progress["deleted"][table] = 0
+            while True:
+                with pooled_connection() as conn, conn.cursor() as cur:
+                    cur.execute(statement, {"topic_id": topic_id, "limit": batch_size})
+                    deleted = cur.rowcount
+                progress["deleted"][table] += deleted
+                if deleted < batch_size:
+                    break
+                time.sleep(pause)
+            logger.info("Purged %d %s rows of topic %d",
+                        progress["deleted"][table], table, topic_id)
+
+        progress["stage"] = "topic"
+        with pooled_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM topic WHERE topic_id = %s AND hidden_at IS NOT NULL;",
+                (topic_id,))
+    except Exception as e:
+        # Left hidden; purge_hidden_topics() picks it up again.
+        logger.exception("Purge of topic %d failed", topic_id)
+        progress["error"] = str(e)
+    finally:
+        progress["finished_at"] = datetime.now(timezone.utc)
+
+    return progress
+
+def purge_hidden_topics() -> list[dict[str, Any]]:
+    """Finishes purges that were interrupted, e.g. by a restart."""
+
+    with pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT topic_id FROM topic WHERE hidden_at IS NOT NULL;")
+        topic_ids = [r[0] for r in cur.fetchall()]
+    return [purge_topic(topic_id) for topic_id in topic_ids]
+
+def get_purge_progress() -> list[dict[str, Any]]:
+    with _purges_lock:
+        return [dict(p, deleted=dict(p["deleted"])) for p in _purges.values()]
 
 def get_topic_by_id(topic_id: int):
-    topics = get_all_topics()
-    for topic in topics:
-        if topic["topic_id"] == topic_id:
-            return topic
-    return None
+    return _topics.get(topic_id)
 
-def get_questions_for_topic(topic_id: int):
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT question_id, question_text FROM question WHERE topic_id = %s ORDER BY question_id DESC;",
-            (topic_id,))
-        questions = cur.fetchall()
-    conn.close()
-    return [{"question_id": q[0], "question_text": q[1]} for q in questions]
+def _topic_updated_at(topic_id: int) -> Optional[datetime]:
+    """When the topic or its questions last changed. Topic pages are cached
+    by version, so they are only read from replicas that have this change."""
+
+    topic = _topics.get(topic_id)
+    return topic["updated_at"] if topic else None
+
+QUESTION_PAGE_SIZE = int(env.get("QUESTION_PAGE_SIZE", 50))
+QUESTION_PAGE_MAX = int(env.get("QUESTION_PAGE_MAX", 200))
+
+# Statements and row mappers shared with the async data layer (async_connection.py)
+_QUESTION_PAGE_SQL = """
+    SELECT question_id, question_text
+    FROM question
+    WHERE topic_id = %(topic_id)s
+      AND (%(before)s::int IS NULL OR question_id < %(before)s)
+    ORDER BY question_id DESC
+    LIMIT %(limit)s;
+"""
+
+def _question_page(rows: list[tuple], limit: int) -> tuple[list[dict[str, Any]], Optional[int]]:
+    next_before = rows[limit - 1][0] if len(rows) > limit else None
+    return ([{"question_id": q[0], "question_text": q[1]} for q in rows[:limit]],
+            next_before)
+
+def get_questions_for_topic(
+        topic_id: int, before: Optional[int] = None,
+        limit: int = QUESTION_PAGE_SIZE) -> tuple[list[dict[str, Any]], Optional[int]]:
+    """Returns one page of a topic's questions, newest first, and the cursor
+    for the next page (None on the last page).
 
+    Pages are keyed on question_id rather than an offset, so every page is a
+    short range scan of idx_question_topic_question however large the topic."""
+
+    limit = max(1, min(limit, QUESTION_PAGE_MAX))
+    def query(cur) -> tuple[list[dict[str, Any]], Optional[int]]:
+        cur.execute(_QUESTION_PAGE_SQL,
+                    {"topic_id": topic_id, "before": before, "limit": limit + 1})
+        return _question_page(cur.fetchall(), limit)
+
+    return read_query(query, _topic_updated_at(topic_id))
 
 def create_question_with_answers(topic_id: int, question_text: str, answers: list[str], correct_indices: set[int], context: Optional[str] = None):
-    conn = get_connection()
-    with conn.cursor() as cur:
+    with pooled_connection() as conn, conn.cursor() as cur:
         cur.execute(
-            "INSERT INTO question (topic_id, question_text) VALUES (%s, %s) RETURNING question_id",
-            (topic_id, question_text)
+            """
+            INSERT INTO question (topic_id, question_text, contextual_info)
+            VALUES (%s, %s, %s)
+            RETURNING question_id
+            """,
+            (topic_id, question_text, context or None)
         )
         row = cur.fetchone()
         question_id = row[0] if row is not None else None
@@ -88,114 +451,477 @@ def create_question_with_answers(topic_id: int, question_text: str, answers: lis
         if question_id is None:
             raise RuntimeError("Failed to insert question")
 
-        for idx, answer_text in enumerate(answers):
-            cur.execute(
-                """
-                INSERT INTO answer (question_id, answer_text, is_correct)
-                VALUES (%s, %s, %s)
-                """,
-                (question_id, answer_text, idx in correct_indices)
-            )
+        insert_rows(
+            cur, "answer", ("question_id", "answer_text", "is_correct"),
+            [(question_id, answer_text, idx in correct_indices)
+             for idx, answer_text in enumerate(answers)])
+        _bump_topic_version(cur, topic_id)
 
-        if context:
-            cur.execute(
-                "UPDATE question SET contextual_info = %s WHERE question_id = %s",
-                (context, question_id)
-            )
+    _topics.invalidate()
+    _sampler.add(topic_id, question_id)
 
-    conn.commit()
-    conn.close()
+def _question_memo() -> dict[int, dict[str, Any]]:
+    """Questions already loaded during the current request."""
 
-def get_topic_id_for_question(question_id: int) -> Optional[int]:
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT topic_id FROM question WHERE question_id = %s;",
-            (question_id,))
-        row = cur.fetchone()
-    conn.close()
-    if row:
-        return row[0]
-    return None
+    if not has_app_context():
+        return {}
+    if "question_memo" not in g:
+        g.question_memo = {}
+    return g.question_memo
 
-def get_question_with_answers(question_id: int) -> Optional[dict[str, Any]]:
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT question_text, contextual_info FROM question WHERE question_id = %s;",
-            (question_id,))
-        question_row = cur.fetchone()
+def _forget_question(question_id: int):
+    _question_memo().pop(question_id, None)
 
-        if not question_row:
-            conn.close()
-            return None
+_QUESTIONS_SQL = """
+    SELECT
+        q.question_id, q.topic_id, q.question_text, q.contextual_info,
+        COALESCE(
+            json_agg(
+                json_build_object(
+                    'answer_id', a.answer_id,
+                    'answer_text', a.answer_text,
+                    'is_correct', a.is_correct)
+                ORDER BY a.answer_id
+            ) FILTER (WHERE a.answer_id IS NOT NULL),
+            '[]'::json) AS answers
+    FROM question q
+    LEFT JOIN answer a ON a.question_id = q.question_id
+    WHERE q.question_id = ANY(%s)
+    GROUP BY q.question_id;
+"""
 
-        question_text, contextual_info = question_row
+def _question_rows(rows: list[tuple]) -> dict[int, dict[str, Any]]:
+    return {
+        row[0]: {
+            "question_id": row[0],
+            "topic_id": row[1],
+            "question_text": row[2],
+            "contextual_info": row[3],
+            "answers": row[4]
+        }
+        for row in rows
+    }
 
-        cur.execute(
-            "SELECT answer_id, answer_text, is_correct FROM answer WHERE question_id = %s;",
-            (question_id,))
-        answers_rows = cur.fetchall()
+def _fetch_questions(cur, question_ids: list[int]) -> dict[int, dict[str, Any]]:
+    cur.execute(_QUESTIONS_SQL, (list(question_ids),))
+    return _question_rows(cur.fetchall())
 
-    conn.close()
+def _load_questions(cur, question_ids: list[int]) -> dict[int, dict[str, Any]]:
+    memo = _question_memo()
+    missing = [qid for qid in dict.fromkeys(question_ids) if qid not in memo]
+    if missing:
+        memo.update(_fetch_questions(cur, missing))
+    return {qid: memo[qid] for qid in question_ids if qid in memo}
 
-    answers = [
-        {"answer_id": a[0], "answer_text": a[1], "is_correct": a[2]}
-        for a in answers_rows
-    ]
+def load_questions(question_ids: list[int]) -> dict[int, dict[str, Any]]:
+    """Loads questions with their answers in one query, keyed by question_id.
+    Questions already loaded during this request are not fetched again."""
 
-    return {
-        "question_id": question_id,
-        "question_text": question_text,
-        "contextual_info": contextual_info,
-        "answers": answers
-    }
+    memo = _question_memo()
+    if all(qid in memo for qid in question_ids):
+        return {qid: memo[qid] for qid in question_ids}
 
-def delete_question(question_id: int):
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute(
-            "DELETE FROM answer WHERE question_id = %s;",
-            (question_id,))
-        cur.execute(
-            "DELETE FROM question WHERE question_id = %s;",
-            (question_id,))
-    conn.commit()
-    conn.close()
+    return read_query(lambda cur: _load_questions(cur, question_ids))
 
-def get_random_question_for_topic(topic_id: int):
-    conn = get_connection()
-    with conn.cursor() as cur:
+def get_question_with_answers(question_id: int) -> Optional[dict[str, Any]]:
+    return load_questions([question_id]).get(question_id)
+
+# Questions keyed by (question_id, topic version). Every edit to a question
+# bumps its topic's version, so entries for an old version are never hit
+# again and just age out.
+_questions = LRUCache(max_size=int(env.get("QUESTION_CACHE_SIZE", 4096)))
+
+def get_cached_question(topic_id: int, question_id: int) -> Optional[dict[str, Any]]:
+    """Returns a question of a visible topic, querying only the first time
+    it is asked for at the topic's current version."""
+
+    topic = _topics.get(topic_id)
+    if topic is None:
+        return None
+    key = (question_id, topic["version"])
+    question = _questions.get(key)
+    if question is None:
+        # The version was read first, so what is cached is at least as new.
+        question = read_query(lambda cur: _load_questions(cur, [question_id]),
+                              topic["updated_at"]).get(question_id)
+        if question is None or question["topic_id"] != topic_id:
+            return None
+        _questions.put(key, question)
+    return question
+
+def get_question_cache_stats() -> dict[str, Any]:
+    return _questions.stats()
+
+def update_question(question_id: int, question_text: str, context: Optional[str],
+                    answers: list[tuple[Optional[int], str, bool]]) -> Optional[int]:
+    """Applies an edit to a question in place, in one transaction.
+
+    `answers` holds (answer_id, answer_text, is_correct) for each submitted
+    answer, with answer_id None for new ones. Only the rows that actually
+    differ are updated, inserted or deleted, so question and answer ids stay
+    stable. Removed answers take their answer_history rows with them, and
+    answer_rollup is adjusted for the removed rows and for answers whose
+    correctness flips. Returns the question's topic_id, or None if it does
+    not exist."""
+
+    with pooled_connection() as conn, conn.cursor() as cur:
         cur.execute("""
-            SELECT question_id
+            SELECT topic_id, question_text, contextual_info
             FROM question
-            WHERE topic_id = %s
-            ORDER BY RANDOM()
-            LIMIT 1;
-        """, (topic_id,))
+            WHERE question_id = %s
+            FOR UPDATE;
+        """, (question_id,))
         row = cur.fetchone()
+        if row is None:
+            return None
+        topic_id, old_text, old_context = row
+        context = context or None
 
-    conn.close()
+        cur.execute("""
+            SELECT answer_id, answer_text, is_correct
+            FROM answer
+            WHERE question_id = %s;
+        """, (question_id,))
+        existing = {r[0]: (r[1], r[2]) for r in cur.fetchall()}
 
-    if not row:
-        return None
+        kept = {answer_id for answer_id, _, _ in answers if answer_id in existing}
+        removed = [answer_id for answer_id in existing if answer_id not in kept]
+        changed = [(answer_id, text, is_correct)
+                   for answer_id, text, is_correct in answers
+                   if answer_id in kept and existing[answer_id] != (text, is_correct)]
+        added = [(question_id, text, is_correct)
+                 for answer_id, text, is_correct in answers
+                 if answer_id not in kept]
 
-    return get_question_with_answers(row[0])
+        question_changed = (old_text, old_context) != (question_text, context)
+        if question_changed:
+            cur.execute("""
+                UPDATE question
+                SET question_text = %s, contextual_info = %s
+                WHERE question_id = %s;
+            """, (question_text, context, question_id))
+        if removed:
+            cur.execute("""
+                WITH deleted AS (
+                    DELETE FROM answer_history
+                    WHERE answer_id = ANY(%(answer_ids)s)
+                    RETURNING answer_id, user_id, answer_time
+                )
+                UPDATE answer_rollup r
+                SET correct = r.correct - d.correct, total = r.total - d.total
+                FROM (
+                    SELECT
+                        date_trunc('month', deleted.answer_time)::date AS month,
+                        deleted.user_id,
+                        COUNT(*) FILTER (WHERE a.is_correct) AS correct,
+                        COUNT(*) AS total
+                    FROM deleted
+                    JOIN answer a ON a.answer_id = deleted.answer_id
+                    GROUP BY 1, 2
+                ) d
+                WHERE r.month = d.month AND r.topic_id = %(topic_id)s AND r.user_id = d.user_id;
+            """, {"answer_ids": removed, "topic_id": topic_id})
+            # A month whose only answers were removed leaves nothing to report.
+            cur.execute("DELETE FROM answer_rollup WHERE topic_id = %s AND total = 0;",
+                        (topic_id,))
+            cur.execute("DELETE FROM answer WHERE answer_id = ANY(%s);", (removed,))
+        flipped = [answer_id for answer_id, _, is_correct in changed
+                   if existing[answer_id][1] != is_correct]
+        if flipped:
+            # Past picks of these answers now count the other way.
+            cur.execute("""
+                UPDATE answer_rollup r
+                SET correct = r.correct + d.delta
+                FROM (
+                    SELECT
+                        date_trunc('month', ah.answer_time)::date AS month,
+                        ah.user_id,
+                        SUM(CASE WHEN a.is_correct THEN -1 ELSE 1 END) AS delta
+                    FROM answer_history ah
+                    JOIN answer a ON a.answer_id = ah.answer_id
+                    WHERE ah.answer_id = ANY(%(answer_ids)s)
+                    GROUP BY 1, 2
+                ) d
+                WHERE r.month = d.month AND r.topic_id = %(topic_id)s AND r.user_id = d.user_id;
+            """, {"answer_ids": flipped, "topic_id": topic_id})
+        if changed:
+            execute_values(cur, """
+                UPDATE answer a
+                SET answer_text = v.answer_text, is_correct = v.is_correct
+                FROM (VALUES %s) AS v(answer_id, answer_text, is_correct)
+                WHERE a.answer_id = v.answer_id;
+            """, changed)
+        insert_rows(cur, "answer", ("question_id", "answer_text", "is_correct"), added)
 
-def insert_answer_history(selected_answers: list[str], user_id: int):
-    conn = get_connection()
-    with conn.cursor() as cur:
-        for answer_id in selected_answers:
+        modified = question_changed or bool(removed or changed or added)
+        if modified:
+            _bump_topic_version(cur, topic_id)
+
+    _forget_question(question_id)
+    if modified:
+        _topics.invalidate()
+    return topic_id
+
+def get_random_question_for_topic(topic_id: int):
+    # The sampler can briefly hold ids deleted by another process; drop
+    # them and draw again.
+    for _ in range(3):
+        sampled = _sampler.sample_topic(topic_id)
+        if not sampled:
+            return None
+
+        question = get_question_with_answers(sampled[0])
+        if question:
+            return question
+        _sampler.remove(topic_id, sampled[0])
+
+    return None
+
+# Spaced-repetition schedule: a wrong answer brings the question back after
+# MASTERY_RETRY; each consecutive right answer doubles the wait, starting
+# at MASTERY_BASE and capped at 2 ** MASTERY_MAX_DOUBLINGS times that.
+MASTERY_RETRY = env.get("MASTERY_RETRY", "10 minutes")
+MASTERY_BASE = env.get("MASTERY_BASE", "1 day")
+MASTERY_MAX_DOUBLINGS = int(env.get("MASTERY_MAX_DOUBLINGS", 7))
+
+# Unseen questions drawn from the sampler per adaptive lookup, and how many
+# to draw on a second try when all of those had been seen already
+MASTERY_CANDIDATES = 8
+MASTERY_WIDE_CANDIDATES = 256
+
+_ADAPTIVE_SQL = """
+    SELECT question_id, priority FROM (
+        (SELECT question_id, 0 AS priority
+         FROM question_mastery
+         WHERE user_id = %(user_id)s AND topic_id = %(topic_id)s
+           AND due_at <= now()
+         ORDER BY due_at
+         LIMIT 1)
+        UNION ALL
+        (SELECT c.question_id, 1
+         FROM unnest(%(candidates)s::int[]) WITH ORDINALITY AS c(question_id, ord)
+         WHERE NOT EXISTS (
+             SELECT 1 FROM question_mastery m
+             WHERE m.user_id = %(user_id)s AND m.question_id = c.question_id)
+         ORDER BY c.ord
+         LIMIT 1)
+        UNION ALL
+        (SELECT question_id, 2
+         FROM question_mastery
+         WHERE user_id = %(user_id)s AND topic_id = %(topic_id)s
+         ORDER BY due_at
+         LIMIT 1)
+    ) next_question
+    ORDER BY priority
+    LIMIT 1;
+"""
+
+def get_next_adaptive_question(user_id: int, topic_id: int) -> Optional[dict[str, Any]]:
+    """Picks the user's most overdue question in the topic, else one they
+    have not seen yet, else the one that comes due soonest. Every branch is
+    an index lookup, so the cost does not grow with answer history. If every
+    sampled candidate had been seen, a wider sample is tried before settling
+    for a question that is not due yet."""
+
+    def query(cur) -> Optional[dict[str, Any]]:
+        for k in (MASTERY_CANDIDATES, MASTERY_WIDE_CANDIDATES):
+            candidates = _sampler.sample_topic(topic_id, k)
+            cur.execute(_ADAPTIVE_SQL,
+                        {"user_id": user_id, "topic_id": topic_id, "candidates": candidates})
+            row = cur.fetchone()
+            if not row:
+                return None
+            if row[1] < 2 or len(candidates) < k:
+                break
+        return _load_questions(cur, [row[0]]).get(row[0])
+
+    return read_query(query)
+
+_ROLLUP_UPSERT = """
+    ON CONFLICT (month, topic_id, user_id) DO UPDATE
+    SET correct = answer_rollup.correct + EXCLUDED.correct,
+        total = answer_rollup.total + EXCLUDED.total
+"""
+
+_MASTERY_UPSERT = """
+    INSERT INTO question_mastery AS m (user_id, question_id, topic_id, streak, last_seen, due_at)
+    SELECT
+        r.user_id, r.question_id, r.topic_id,
+        CASE WHEN r.is_correct THEN 1 ELSE 0 END,
+        r.answered_at,
+        r.answered_at + CASE WHEN r.is_correct THEN %(base)s::interval ELSE %(retry)s::interval END
+    FROM unnest(%(user_ids)s::int[], %(question_ids)s::int[], %(topic_ids)s::int[],
+                %(correct)s::bool[], %(answered_at)s::timestamptz[])
+        AS r(user_id, question_id, topic_id, is_correct, answered_at)
+    ON CONFLICT (user_id, question_id) DO UPDATE
+    SET streak = CASE WHEN EXCLUDED.streak > 0 THEN m.streak + 1 ELSE 0 END,
+        last_seen = EXCLUDED.last_seen,
+        due_at = EXCLUDED.last_seen + CASE
+            WHEN EXCLUDED.streak > 0
+                THEN %(base)s::interval * power(2, LEAST(m.streak, %(max_doublings)s))
+            ELSE %(retry)s::interval
+        END;
+"""
+
+def write_answer_events(events: list[tuple[int, int, int, tuple[int, ...], datetime, bool]]):
+    """Writes practice answers, each (user_id, question_id, topic_id,
+    answer_ids, answered_at, is_correct), in one transaction: the picked
+    answers go into answer_history and the monthly rollup, and each answer
+    moves the question's due time for its user."""
+
+    with pooled_connection() as conn, conn.cursor() as cur:
+        picks = [(answer_id, e[0], e[4]) for e in events for answer_id in e[3]]
+        if picks:
             cur.execute("""
-                INSERT INTO answer_history (answer_id, user_id)
-                VALUES (%s, %s);
-            """, (answer_id, user_id))
-    conn.commit()
-    conn.close()
+                WITH inserted AS (
+                    INSERT INTO answer_history (answer_id, user_id, answer_time)
+                    SELECT *
+                    FROM unnest(%(answer_ids)s::int[], %(user_ids)s::int[],
+                                %(answer_times)s::timestamptz[])
+                    RETURNING answer_id, user_id, answer_time
+                )
+                INSERT INTO answer_rollup (month, topic_id, user_id, correct, total)
+                SELECT
+                    date_trunc('month', i.answer_time)::date,
+                    q.topic_id,
+                    i.user_id,
+                    COUNT(*) FILTER (WHERE a.is_correct),
+                    COUNT(*)
+                FROM inserted i
+                JOIN answer a ON a.answer_id = i.answer_id
+                JOIN question q ON q.question_id = a.question_id
+                GROUP BY 1, 2, 3
+            """ + _ROLLUP_UPSERT, {
+                "answer_ids": [p[0] for p in picks],
+                "user_ids": [p[1] for p in picks],
+                "answer_times": [p[2] for p in picks]
+            })
+
+        # An upsert can touch each (user, question) row once, so repeat
+        # answers in one batch go in later rounds, in the order given.
+        rounds: list[list[tuple]] = []
+        seen: dict[tuple[int, int], int] = {}
+        for e in events:
+            n = seen.get((e[0], e[1]), 0)
+            seen[(e[0], e[1])] = n + 1
+            if n == len(rounds):
+                rounds.append([])
+            rounds[n].append(e)
+        for batch in rounds:
+            cur.execute(_MASTERY_UPSERT, {
+                "user_ids": [e[0] for e in batch],
+                "question_ids": [e[1] for e in batch],
+                "topic_ids": [e[2] for e in batch],
+                "correct": [e[5] for e in batch],
+                "answered_at": [e[4] for e in batch],
+                "base": MASTERY_BASE,
+                "retry": MASTERY_RETRY,
+                "max_doublings": MASTERY_MAX_DOUBLINGS
+            })
+
+# With ANSWER_HISTORY_ASYNC=1 practice answers, history and mastery alike,
+# are buffered in memory and written in batches by a background thread
+# instead of on the request.
+_history_writer: Optional[BufferedWriter] = None
+if env.get("ANSWER_HISTORY_ASYNC") == "1":
+    _history_writer = BufferedWriter(
+        write_answer_events,
+        max_queue=int(env.get("ANSWER_HISTORY_QUEUE", 10000)),
+        flush_size=int(env.get("ANSWER_HISTORY_FLUSH_SIZE", 500)),
+        flush_interval=float(env.get("ANSWER_HISTORY_FLUSH_INTERVAL", 1)),
+        max_retries=int(env.get("ANSWER_HISTORY_MAX_RETRIES", 10)),
+        # Rows the database rejects will be rejected again on retry.
+        is_permanent=lambda e: isinstance(e, (psycopg2.IntegrityError, psycopg2.DataError)))
+    atexit.register(_history_writer.close)
+
+def get_history_writer_stats() -> Optional[dict[str, Any]]:
+    return _history_writer.stats() if _history_writer else None
+
+def record_practice_answer(user_id: int, topic_id: int, question_id: int,
+                           selected_answers: list[str]):
+    """Records the answers a user picked for a practice question and grades
+    them: right means exactly the correct answers were selected. Raises
+    ValueError if the question is not in the topic or any answer is not
+    one of its answers."""
+
+    question = get_cached_question(topic_id, question_id)
+    if question is None:
+        raise ValueError(f"Unknown question {question_id} in topic {topic_id}")
+    answer_ids = {a["answer_id"] for a in question["answers"]}
+    correct_ids = {a["answer_id"] for a in question["answers"] if a["is_correct"]}
+    selected = tuple(dict.fromkeys(int(answer_id) for answer_id in selected_answers))
+    if not answer_ids.issuperset(selected):
+        raise ValueError(f"Answers {selected} do not all belong to question {question_id}")
+
+    # As in submit_exam, a question without correct answers is never right.
+    events = [(user_id, question_id, topic_id, selected, datetime.now(timezone.utc),
+               bool(correct_ids) and set(selected) == correct_ids)]
+
+    # Falls back to a synchronous write when the buffer is full.
+    if _history_writer is None or not _history_writer.submit(events):
+        write_answer_events(events)
 
-def create_exam(user_id: int, num_questions: int, duration: int) -> int:
-    conn = get_connection()
-    with conn.cursor() as cur:
+def backfill_answer_rollup() -> int:
+    """Rebuilds answer_rollup from the full answer_history. Inserts into
+    answer_history wait until it finishes. Returns the number of rollup rows."""
+
+    with pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("LOCK TABLE answer_history IN SHARE MODE;")
+        cur.execute("DELETE FROM answer_rollup;")
+        cur.execute("""
+            INSERT INTO answer_rollup (month, topic_id, user_id, correct, total)
+            SELECT
+                date_trunc('month', ah.answer_time)::date,
+                q.topic_id,
+                ah.user_id,
+                COUNT(*) FILTER (WHERE a.is_correct),
+                COUNT(*)
+            FROM answer_history ah
+            JOIN answer a ON a.answer_id = ah.answer_id
+            JOIN question q ON q.question_id = a.question_id
+            GROUP BY 1, 2, 3;
+        """)
+        return cur.rowcount
+
+def get_monthly_accuracy(user_id: Optional[int] = None) -> list[dict[str, Any]]:
+    """Monthly accuracy per topic, for everyone or for a single user."""
+
+    def query(cur) -> list[tuple]:
+        cur.execute("""
+            SELECT
+                r.month,
+                t.topic_name,
+                SUM(r.correct) AS correct,
+                SUM(r.total) AS total
+            FROM answer_rollup r
+            JOIN topic t ON t.topic_id = r.topic_id
+            WHERE t.hidden_at IS NULL
+              AND (%(user_id)s::int IS NULL OR r.user_id = %(user_id)s)
+            GROUP BY r.month, t.topic_name
+            ORDER BY t.topic_name, r.month;
+        """, {"user_id": user_id})
+        return cur.fetchall()
+
+    rows = read_query(query)
+
+    return [
+        {
+            "month": r[0],
+            "topic_name": r[1],
+            "correct": r[2],
+            "total": r[3],
+            "accuracy_percent": round(100 * r[2] / r[3], 2) if r[3] else 0
+        }
+        for r in rows
+    ]
+
+def create_exam(user_id: int, num_questions: int, duration: int, stratified: bool = False) -> int:
+    if stratified:
+        question_ids = _sampler.sample_stratified(num_questions)
+    else:
+        question_ids = _sampler.sample(num_questions)
+
+    with pooled_connection() as conn, conn.cursor() as cur:
 
         # Create exam
         cur.execute("""
@@ -207,162 +933,241 @@ def create_exam(user_id: int, num_questions: int, duration: int) -> int:
         row = cur.fetchone()
         exam_id = row[0] if row else None
 
-        # Random questions from all subjects
+        # The sampler can lag deletes made by other processes, so only
+        # questions that still exist in a visible topic go into the exam.
         cur.execute("""
-            SELECT question_id
-            FROM question
-            ORDER BY RANDOM()
-            LIMIT %s
-        """, (num_questions,))
+            INSERT INTO exam_question (exam_id, question_id, position)
+            SELECT %(exam_id)s, s.question_id, row_number() OVER (ORDER BY s.ord) - 1
+            FROM unnest(%(question_ids)s::int[]) WITH ORDINALITY AS s(question_id, ord)
+            JOIN question q ON q.question_id = s.question_id
+            JOIN topic t ON t.topic_id = q.topic_id
+            WHERE t.hidden_at IS NULL
+            RETURNING question_id
+        """, {"exam_id": exam_id, "question_ids": question_ids})
+        inserted = {r[0] for r in cur.fetchall()}
 
-        questions = cur.fetchall()
+        if len(inserted) < num_questions:
+            cur.execute("UPDATE exam SET total_questions = %s WHERE exam_id = %s",
+                        (len(inserted), exam_id))
 
-        for index, q in enumerate(questions):
-            cur.execute("""
-                INSERT INTO exam_question (exam_id, question_id, position)
-                VALUES (%s, %s, %s)
-            """, (exam_id, q[0], index))
+    stale = [qid for qid in question_ids if qid not in inserted]
+    if stale:
+        _sampler.discard(stale)
 
-        conn.commit()
-        conn.close()
     if exam_id:
         return exam_id
     else:
         raise RuntimeError("Failed to create exam")
 
 def create_user_in_db(username: str, password_hash: str):
-    conn = get_connection()
-    with conn.cursor() as cur:
+    with pooled_connection() as conn, conn.cursor() as cur:
         cur.execute(
             "INSERT INTO users (username, password_hash) VALUES (%s, %s);",
             (username, password_hash))
-    conn.commit()
-    conn.close()
 
-def get_signed_in_user(username: str, password: str) -> Optional[int]:
-    conn = get_connection()
-    with conn.cursor() as cur:
+def get_user_credentials(username: str) -> Optional[tuple[int, str]]:
+    """Returns (user_id, password_hash) for a username, if it exists."""
+    with pooled_connection() as conn, conn.cursor() as cur:
         cur.execute("""
             SELECT user_id, password_hash
             FROM users
             WHERE username = %s
         """, (username,))
-        row = cur.fetchone()
-    conn.close()
+        return cur.fetchone()
 
-    if not row:
-        return None
+def update_password_hash(user_id: int, password_hash: str) -> None:
+    with pooled_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE users
+            SET password_hash = %s
+            WHERE user_id = %s
+        """, (password_hash, user_id))
 
-    user_id, password_hash = row
+_EXAM_SQL = """
+    SELECT user_id, start_time, end_time, duration_minutes, score_percent
+    FROM exam
+    WHERE exam_id = %s
+"""
+
+_EXAM_QUESTION_IDS_SQL = """
+    SELECT question_id
+    FROM exam_question
+    WHERE exam_id = %s
+    ORDER BY position
+"""
 
-    if not check_password_hash(password_hash, password):
-        return None
-    return user_id
 def get_exam(exam_id: int) -> Optional[dict[str, Any]]:
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT user_id, start_time, duration_minutes, score_percent
-            FROM exam
-            WHERE exam_id = %s
-        """, (exam_id,))
-        row = cur.fetchone()
+    def query(cur) -> Optional[dict[str, Any]]:
+        cur.execute(_EXAM_SQL, (exam_id,))
+        return _exam_row(exam_id, cur.fetchone())
 
-    conn.close()
+    return read_query(query)
 
+def _exam_row(exam_id: int, row: Optional[tuple]) -> Optional[dict[str, Any]]:
     if not row:
         return None
 
-    user_id, start_time, duration_minutes, score_percent = row
+    user_id, start_time, end_time, duration_minutes, score_percent = row
 
     return {
         "exam_id": exam_id,
         "user_id": user_id,
         "start_time": start_time,
+        "end_time": end_time,
         "duration_minutes": duration_minutes,
         "score_percent": score_percent
     }
 
 def get_exam_questions(exam_id: int) -> list[dict[str, Any]]:
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT 
-                    q.question_id, q.question_text, q.contextual_info,
-                    a.answer_id, a.answer_text, a.is_correct
-            FROM 
-                exam_question eq
-            JOIN question q ON eq.question_id = q.question_id
-            JOIN answer a ON q.question_id = a.question_id
-            WHERE eq.exam_id = %s
-            ORDER BY eq.position, a.answer_id
-        """, (exam_id,))
-        rows = cur.fetchall()
+    def query(cur) -> list[dict[str, Any]]:
+        cur.execute(_EXAM_QUESTION_IDS_SQL, (exam_id,))
+        question_ids = [row[0] for row in cur.fetchall()]
+
+        questions = _load_questions(cur, question_ids)
+        return [questions[qid] for qid in question_ids if qid in questions]
 
-    conn.close()
+    return read_query(query)
 
-    questions_dict = {}
-    for row in rows:
-        question_id, question_text, contextual_info, answer_id, answer_text, is_correct = row
-        if question_id not in questions_dict:
-            questions_dict[question_id] = {
-                "question_id": question_id,
-                "question_text": question_text,
-                "contextual_info": contextual_info,
-                "answers": []
-            }
-        questions_dict[question_id]["answers"].append({
-            "answer_id": answer_id,
-            "answer_text": answer_text,
-            "is_correct": is_correct
-        })
+_exam_results = LRUCache(max_size=int(env.get("EXAM_RESULT_CACHE_SIZE", 1024)))
+
+def _exam_result_row(row: tuple) -> dict[str, Any]:
+    exam_id, user_id, finished_at, score_percent, correct_count, total, questions = row
+    return {
+        "exam_id": exam_id,
+        "user_id": user_id,
+        "finished_at": finished_at,
+        "score_percent": float(score_percent),
+        "correct_count": correct_count,
+        "total": total,
+        "questions": questions
+    }
 
-    return list(questions_dict.values())
+def get_exam_result(exam_id: int) -> Optional[dict[str, Any]]:
+    """Returns the stored result of a finished exam, or None if the exam
+    has not been submitted. Results never change once written, so they are
+    cached in-process without expiry."""
 
+    result = _exam_results.get(exam_id)
+    if result is not None:
+        return result
 
+    def query(cur) -> Optional[tuple]:
+        cur.execute("""
+            SELECT exam_id, user_id, finished_at, score_percent,
+                   correct_count, total, questions
+            FROM exam_result
+            WHERE exam_id = %s
+        """, (exam_id,))
+        return cur.fetchone()
 
-def submit_exam(exam_id: int) -> dict[str, Any]:
-    conn = get_connection()
-    with conn.cursor() as cur:
+    row = read_query(query)
 
-        questions = get_exam_questions(exam_id)
+    if not row:
+        return None
 
-        correct_count = 0
-        total = len(questions)
+    result = _exam_result_row(row)
+    _exam_results.put(exam_id, result)
+    return result
 
-        for q in questions:
-            # Get selected answers (list of answer_ids as strings)
-            selected_answers = request.form.getlist(f"question_{q['question_id']}[]")
+def get_exam_result_cache_stats() -> dict[str, Any]:
+    return _exam_results.stats()
 
-            # Get correct answers from DB
-            cur.execute("""
-                SELECT answer_id
-                FROM answer
-                WHERE question_id = %s AND is_correct = true
-            """, (q['question_id'],))
-            correct_answers = {str(row[0]) for row in cur.fetchall()}
+def submit_exam(exam_id: int, selections: dict[int, list[int]]) -> Optional[dict[str, Any]]:
+    """Stores the selected answers for every exam question in exam_answer,
+    grades the exam and writes its exam_result row in one statement. A
+    question counts as correct when exactly its correct answers were
+    selected; one with no correct answers never does. Unanswered questions are stored with a NULL answer_id.
 
-            # Compare sets (exact match)
-            if set(selected_answers) == correct_answers:
-                correct_count += 1
+    An exam can only be submitted once; submitting a finished exam again
+    returns the stored result. Returns None for an unknown exam."""
 
-        percent = (correct_count / total) * 100 if total > 0 else 0
+    question_ids: list[int] = []
+    answer_ids: list[int] = []
+    for question_id, selected in selections.items():
+        for answer_id in dict.fromkeys(selected):
+            question_ids.append(question_id)
+            answer_ids.append(answer_id)
 
+    with pooled_connection() as conn, conn.cursor() as cur:
         cur.execute("""
-            UPDATE exam
-            SET end_time = now(),
-                score_percent = %s
-            WHERE exam_id = %s
-        """, (percent, exam_id))
+            WITH open_exam AS (
+                SELECT exam_id
+                FROM exam
+                WHERE exam_id = %(exam_id)s AND end_time IS NULL
+                FOR UPDATE
+            ),
+            selected AS (
+                SELECT question_id, answer_id
+                FROM unnest(%(question_ids)s::int[], %(answer_ids)s::int[])
+                    AS s(question_id, answer_id)
+            ),
+            submitted AS (
+                INSERT INTO exam_answer (exam_id, question_id, answer_id, is_correct)
+                SELECT eq.exam_id, eq.question_id, a.answer_id, COALESCE(a.is_correct, false)
+                FROM exam_question eq
+                JOIN open_exam USING (exam_id)
+                LEFT JOIN selected s ON s.question_id = eq.question_id
+                LEFT JOIN answer a
+                    ON a.answer_id = s.answer_id AND a.question_id = eq.question_id
+                RETURNING question_id, answer_id, is_correct
+            ),
+            graded AS (
+                SELECT
+                    eq.question_id,
+                    eq.position,
+                    c.correct_total > 0
+                        AND COUNT(s.answer_id) FILTER (WHERE s.is_correct) = c.correct_total
+                        AND COUNT(s.answer_id) FILTER (WHERE NOT s.is_correct) = 0
+                        AS is_correct
+                FROM exam_question eq
+                JOIN open_exam USING (exam_id)
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS correct_total
+                    FROM answer
+                    WHERE question_id = eq.question_id AND is_correct
+                ) c
+                LEFT JOIN submitted s ON s.question_id = eq.question_id
+                GROUP BY eq.question_id, eq.position, c.correct_total
+            ),
+            scored AS (
+                UPDATE exam
+                SET end_time = now(),
+                    score_percent = COALESCE((
+                        SELECT 100.0 * COUNT(*) FILTER (WHERE is_correct) / NULLIF(COUNT(*), 0)
+                        FROM graded
+                    ), 0)
+                WHERE exam_id IN (SELECT exam_id FROM open_exam)
+                RETURNING exam_id, user_id, end_time, score_percent
+            )
+            INSERT INTO exam_result (exam_id, user_id, finished_at, score_percent,
+                                     correct_count, total, questions)
+            SELECT s.exam_id, s.user_id, s.end_time, s.score_percent,
+                   (SELECT COUNT(*) FILTER (WHERE is_correct) FROM graded),
+                   (SELECT COUNT(*) FROM graded),
+                   COALESCE((
+                       SELECT json_agg(json_build_object(
+                                  'question_id', g.question_id,
+                                  'question_text', q.question_text,
+                                  'is_correct', g.is_correct)
+                              ORDER BY g.position)
+                       FROM graded g
+                       JOIN question q USING (question_id)
+                   ), '[]')
+            FROM scored s
+            RETURNING exam_id, user_id, finished_at, score_percent,
+                      correct_count, total, questions;
+        """, {"exam_id": exam_id,
+              "question_ids": question_ids,
+              "answer_ids": answer_ids})
+        row = cur.fetchone()
 
-        conn.commit()
+    if not row:
+        # Already finished (or no such exam): serve what was stored.
+        return get_exam_result(exam_id)
 
-    conn.close()
-    return {
-        "score_percent": percent,
-        "correct_count": correct_count,
-        "total": total
-    }
+    result = _exam_result_row(row)
+    _exam_results.put(exam_id, result)
+    return result
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
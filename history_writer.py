@@ -0,0 +1,199 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedWriter(Generic[T]):
+    """Collects events in a bounded in-memory queue and writes them from a
+    background thread in batches, once `flush_size` events are waiting or
+    `flush_interval` seconds have passed.
+
+    When the queue is full, submit() waits up to `put_timeout` seconds for
+    room and then returns False, so the caller can write the events itself.
+
+    Batches that fail to write are retried on the next flush. Once a failure
+    is permanent (`is_permanent(error)`, or `max_retries` flushes in a row
+    have failed) the batch is split in halves until the events that cannot
+    be written are on their own; those are logged and dropped so they do
+    not hold up everything queued behind them.
+    """
+
+    def __init__(self, write: Callable[[list[T]], None],
+                 max_queue: int = 10_000,
+                 flush_size: int = 500,
+                 flush_interval: float = 1.0,
+                 put_timeout: float = 0.05,
+                 max_retries: int = 10,
+                 is_permanent: Callable[[Exception], bool] = lambda error: False):
+        self._write = write
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self._is_permanent = is_permanent
+        self._attempts = 0
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._pending: list[T] = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        self.submitted = 0
+        self.rejected = 0
+        self.written = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+        self._flush_time = 0.0
+        self._max_flush_time = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="history-writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, events: list[T]) -> bool:
+        """Queues events for writing. Returns False if the writer is closed
+        or the queue stayed full; `events` is then left holding the events
+        that were not queued."""
+
+        if self._closed.is_set():
+            return False
+
+        deadline = time.monotonic() + self.put_timeout
+        for i, event in enumerate(events):
+            try:
+                self._queue.put(event, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                with self._lock:
+                    self.submitted += i
+                    self.rejected += len(events) - i
+                # Hand the rest back: the caller writes them synchronously.
+                del events[:i]
+                return False
+
+        with self._lock:
+            self.submitted += len(events)
+        return True
+
+    def _drain(self, limit: int) -> None:
+        while len(self._pending) < limit:
+            try:
+                self._pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _flush(self) -> bool:
+        if not self._pending:
+            return True
+
+        batch = self._pending[:self.flush_size]
+        try:
+            self._write_front(batch)
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            self._attempts += 1
+            if not self._permanent(e):
+                logger.exception("Failed to write %d buffered events", len(batch))
+                return False
+            logger.warning("Writing %d buffered events failed for good (%s); "
+                           "isolating the events that cannot be written", len(batch), e)
+            if not self._isolate(batch):
+                return False
+
+        self._attempts = 0
+        return True
+
+    def _permanent(self, error: Exception) -> bool:
+        return self._is_permanent(error) or self._attempts >= self.max_retries
+
+    def _write_front(self, batch: list[T]) -> None:
+        """Writes `batch`, which must be the head of `_pending`, and removes it."""
+
+        started = time.monotonic()
+        self._write(batch)
+        elapsed = time.monotonic() - started
+        del self._pending[:len(batch)]
+        with self._lock:
+            self.written += len(batch)
+            self.flushes += 1
+            self._flush_time += elapsed
+            self._max_flush_time = max(self._max_flush_time, elapsed)
+
+    def _isolate(self, batch: list[T]) -> bool:
+        """Writes `batch` in ever smaller halves and drops the single events
+        that still fail permanently. Returns False, leaving the rest pending,
+        if a transient error interrupts it."""
+
+        chunks = [batch]
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                self._write_front(chunk)
+            except Exception as e:
+                if not self._permanent(e):
+                    logger.exception("Failed to write %d buffered events", len(chunk))
+                    return False
+                if len(chunk) > 1:
+                    middle = len(chunk) // 2
+                    chunks += [chunk[middle:], chunk[:middle]]
+                    continue
+                logger.error("Dropped buffered event that cannot be written: %r (%s)",
+                             chunk[0], e)
+                del self._pending[:1]
+                with self._lock:
+                    self.dropped += 1
+        return True
+
+    def _run(self) -> None:
+        last_flush = time.monotonic()
+        while not self._closed.is_set():
+            timeout = max(0.0, last_flush + self.flush_interval - time.monotonic())
+            try:
+                self._pending.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                pass
+            self._drain(self.flush_size)
+
+            if (len(self._pending) >= self.flush_size
+                    or time.monotonic() - last_flush >= self.flush_interval):
+                if not self._flush():
+                    # Back off before retrying the failed batch.
+                    self._closed.wait(self.flush_interval)
+                last_flush = time.monotonic()
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stops accepting events and writes everything still buffered."""
+
+        self._closed.set()
+        self._thread.join(timeout)
+
+        deadline = time.monotonic() + timeout
+        self._drain(len(self._pending) + self._queue.qsize())
+        while self._pending and time.monotonic() < deadline:
+            if not self._flush():
+                break
+
+        if self._pending:
+            logger.error("Dropped %d buffered events on shutdown", len(self._pending))
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize() + len(self._pending),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "written": self.written,
+                "flushes": self.flushes,
+                "failures": self.failures,
+                "dropped": self.dropped,
+                "avg_flush_ms": (1000 * self._flush_time / self.flushes
+                                 if self.flushes else 0.0),
+                "max_flush_ms": 1000 * self._max_flush_time,
+            }
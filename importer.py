@@ -0,0 +1,383 @@
+"""Shared plumbing for the PDF importers (scrape-book.py, scrape-test.py)."""
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+
+import pdfplumber
+import psycopg2
+
+from bulk import copy_rows
+from cache import TOPIC_CHANNEL
+
+T = TypeVar("T")
+
+CACHE_DIR = ".import_cache"
+
+# DMBOK knowledge areas and the topic their questions are imported into
+topic_map = {
+    "Data Management":"DAMA Chapter 1",
+    "Data Handling Ethics":"DAMA Chapter 2 D Handling Ethics",
+    "Data Governance":"DAMA Chapter 3 Governance",
+    "Data Architecture":"DAMA Chapter 4 Architecture",
+    "Data Modelling and Design":"DAMA Chapter 5 D Model & Design",
+    "Data Storage and Operations":"DAMA Chapter 6 D storage & Ops",
+    "Data Security":"DAMA Chapter 7 D security",
+    "Data Integration and Interoperability":"DAMA Chapter 8 D integration and Interoperability",
+    "Document and content management":"DAMA Chapter 9 - Document and content management",
+    "Reference and master data":"DAMA Chapter 10 - Reference and Master Data",
+    "Data warehouse and business intelligence":"DAMA Chapter 11 - Data Warehousing and Business Intelligence",
+    "Metadata management":"DAMA Chapter 12 - Metadata Management",
+    "Data quality":"DAMA Chapter 13 - Data Quality",
+    "Big data and data science":"DAMA Chapter 14 - Big Data and Data Science",
+    "Data Management Maturity Assessment":"DAMA Chapter 15 - Data Management Maturity Assessment",
+    "Data Management Organization and Role Expectations":"DAMA Chapter 16 - Data Management Organization and Role Expectations",
+    "Data Management and Organizational Change Management":"DAMA Chapter 17 - Data Management and Organizational Change Management",
+}
+
+# DMBOK chapter number -> topic name, from the same mapping
+chapter_topics = {
+    int(re.match(r"DAMA Chapter (\d+)", name).group(1)): name
+    for name in topic_map.values()
+}
+
+_DONE = object()
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def extract_lines(pdf_path: str, cache_dir: Optional[str] = CACHE_DIR) -> Iterator[str]:
+    """Yields the text lines of a PDF one page at a time.
+
+    Extracted page text is cached under `cache_dir`, keyed by the PDF's
+    content hash and page number, so re-runs and resumed imports skip
+    pdfplumber for pages already seen. Pass cache_dir=None to disable.
+    """
+
+    if cache_dir is None:
+        pages = _extract_pages(pdf_path, None)
+    else:
+        pdf_dir = os.path.join(cache_dir, file_hash(pdf_path))
+        os.makedirs(pdf_dir, exist_ok=True)
+        pages = _extract_pages(pdf_path, pdf_dir)
+
+    for text in pages:
+        if text:
+            yield from text.split("\n")
+
+
+def _extract_pages(pdf_path: str, pdf_dir: Optional[str]) -> Iterator[str]:
+    if pdf_dir is not None:
+        complete = os.path.join(pdf_dir, "complete")
+        if os.path.exists(complete):
+            with open(complete, encoding="utf-8") as f:
+                page_count = int(f.read())
+            for number in range(page_count):
+                with open(os.path.join(pdf_dir, f"{number}.txt"), encoding="utf-8") as f:
+                    yield f.read()
+            return
+
+    with pdfplumber.open(pdf_path) as pdf:
+        for number, page in enumerate(pdf.pages):
+            cached = os.path.join(pdf_dir, f"{number}.txt") if pdf_dir else None
+
+            if cached and os.path.exists(cached):
+                with open(cached, encoding="utf-8") as f:
+                    yield f.read()
+                continue
+
+            text = page.extract_text() or ""
+            # pdfplumber keeps parsed layout objects on each page; drop them
+            # so memory stays flat for large PDFs.
+            page.flush_cache()
+
+            if cached:
+                _write_atomic(cached, text)
+            yield text
+
+        if pdf_dir is not None:
+            _write_atomic(os.path.join(pdf_dir, "complete"), str(len(pdf.pages)))
+
+
+def content_hash(question: str, answers: list[str], correct: list[int]) -> str:
+    """Hash of a question's normalized text and answers, used to recognise
+    questions that were already imported."""
+
+    def normalize(text: str) -> str:
+        return " ".join(text.split()).casefold()
+
+    parts = [normalize(question)]
+    parts.extend(f"{position in correct:d}:{normalize(answer)}"
+                 for position, answer in enumerate(answers, start=1))
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def run_pipeline(items: Iterable[T],
+                 load_batch: Callable[[list[T]], None],
+                 batch_size: int = 100,
+                 max_pending: int = 1000,
+                 flush_interval: float = 2.0) -> int:
+    """Loads items in batches while they are still being produced.
+
+    `items` (typically extract -> parse generators) is consumed on a
+    background thread and handed over through a bounded queue, so extraction
+    and parsing overlap with database writes and at most `max_pending` items
+    are held in memory. A partial batch is loaded once `flush_interval`
+    seconds pass without a new item. Returns the number of items loaded.
+    """
+
+    pending: queue.Queue = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Blocks while the loader is behind, but gives up once it has stopped.
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failed(e))
+
+    producer = threading.Thread(target=produce, name="import-producer", daemon=True)
+    producer.start()
+
+    loaded = 0
+    batch: list[T] = []
+    try:
+        while True:
+            try:
+                item = pending.get(timeout=flush_interval)
+            except queue.Empty:
+                if batch:
+                    load_batch(batch)
+                    loaded += len(batch)
+                    batch = []
+                continue
+
+            if item is _DONE:
+                break
+            if isinstance(item, _Failed):
+                raise item.error
+
+            batch.append(item)
+            if len(batch) >= batch_size:
+                load_batch(batch)
+                loaded += len(batch)
+                batch = []
+
+        if batch:
+            load_batch(batch)
+            loaded += len(batch)
+    finally:
+        stop.set()
+        producer.join(timeout=1)
+
+    return loaded
+
+
+@dataclass
+class LoadReport:
+    questions: int = 0
+    answers: int = 0
+    updated: int = 0
+    skipped: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        rows = self.questions + self.answers
+        return rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (f"Loaded {self.questions} questions and {self.answers} answers "
+                f"({self.updated} updated, {self.skipped} already imported) "
+                f"in {self.batches} batches, {self.seconds:.2f}s "
+                f"({self.rows_per_second:,.0f} rows/sec)")
+
+
+class BulkLoader:
+    """Loads parsed questions with COPY into temp staging tables and merges
+    them into question/answer in one transaction per batch.
+
+    Questions are matched on their content hash: ones already in the bank
+    are not inserted again (only their explanation is refreshed if it
+    changed), so an interrupted import can simply be re-run.
+
+    Questions are anything with `question`, `answers`, `correct` (1-based
+    answer positions) and `explanation` attributes.
+    """
+
+    def __init__(self, conn: psycopg2.extensions.connection, quiet: bool = False):
+        self.conn = conn
+        self.quiet = quiet
+        self.report = LoadReport()
+        self._staged = False
+
+    def _create_staging(self, cur) -> None:
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS stage_question (
+                seq INTEGER PRIMARY KEY,
+                topic_id INTEGER NOT NULL,
+                question_text TEXT NOT NULL,
+                contextual_info TEXT,
+                content_hash TEXT NOT NULL,
+                question_id INTEGER,
+                is_new BOOLEAN NOT NULL DEFAULT false
+            ) ON COMMIT DELETE ROWS;
+
+            CREATE TEMP TABLE IF NOT EXISTS stage_answer (
+                seq INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                answer_text TEXT NOT NULL,
+                is_correct BOOLEAN NOT NULL
+            ) ON COMMIT DELETE ROWS;
+        """)
+        self._staged = True
+
+    def load(self, batch: list[tuple[int, Any]]) -> dict[int, int]:
+        """Loads (topic_id, question) pairs and returns a mapping from each
+        pair's index in the batch to its question_id, new or existing."""
+
+        if not batch:
+            return {}
+
+        started = time.perf_counter()
+        answers = [
+            (seq, position, answer, position in q.correct)
+            for seq, (_, q) in enumerate(batch)
+            for position, answer in enumerate(q.answers, start=1)
+        ]
+
+        try:
+            with self.conn.cursor() as cur:
+                if not self._staged:
+                    self._create_staging(cur)
+
+                copy_rows(cur, "stage_question",
+                          ("seq", "topic_id", "question_text", "contextual_info",
+                           "content_hash"),
+                          ((seq, topic_id, q.question, q.explanation,
+                            content_hash(q.question, q.answers, q.correct))
+                           for seq, (topic_id, q) in enumerate(batch)))
+                copy_rows(cur, "stage_answer",
+                          ("seq", "position", "answer_text", "is_correct"),
+                          answers)
+
+                # Match questions that are already in the bank.
+                cur.execute("""
+                    UPDATE stage_question sq
+                    SET question_id = q.question_id
+                    FROM question q
+                    WHERE q.content_hash = sq.content_hash;
+                """)
+                cur.execute("""
+                    UPDATE question q
+                    SET contextual_info = sq.contextual_info
+                    FROM stage_question sq
+                    WHERE q.question_id = sq.question_id
+                      AND q.contextual_info IS DISTINCT FROM sq.contextual_info;
+                """)
+                updated = cur.rowcount
+
+                # Reserve ids for the first copy of each new question so
+                # staged answers can be joined to it without relying on
+                # RETURNING order; later copies in the batch reuse that id.
+                cur.execute("""
+                    UPDATE stage_question
+                    SET question_id = nextval(pg_get_serial_sequence('question', 'question_id')),
+                        is_new = true
+                    WHERE question_id IS NULL
+                      AND seq IN (
+                          SELECT min(seq) FROM stage_question
+                          WHERE question_id IS NULL
+                          GROUP BY content_hash);
+
+                    UPDATE stage_question sq
+                    SET question_id = first.question_id
+                    FROM stage_question first
+                    WHERE sq.question_id IS NULL
+                      AND first.is_new
+                      AND first.content_hash = sq.content_hash;
+
+                    INSERT INTO question (question_id, topic_id, question_text,
+                                          contextual_info, content_hash)
+                    OVERRIDING SYSTEM VALUE
+                    SELECT question_id, topic_id, question_text, contextual_info, content_hash
+                    FROM stage_question
+                    WHERE is_new
+                    ORDER BY seq;
+
+                    INSERT INTO answer (question_id, answer_text, is_correct)
+                    SELECT sq.question_id, sa.answer_text, sa.is_correct
+                    FROM stage_answer sa
+                    JOIN stage_question sq USING (seq)
+                    WHERE sq.is_new
+                    ORDER BY sa.seq, sa.position;
+                """)
+                cur.execute("SELECT seq, question_id, is_new FROM stage_question;")
+                rows = cur.fetchall()
+
+                # Topics that gained questions need fresh pages in the app.
+                cur.execute("""
+                    UPDATE topic
+                    SET version = version + 1, updated_at = now()
+                    WHERE topic_id IN (SELECT topic_id FROM stage_question WHERE is_new);
+                """)
+                if cur.rowcount:
+                    cur.execute(f"NOTIFY {TOPIC_CHANNEL};")
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            # The staging tables may have been created in this transaction.
+            self._staged = False
+            raise
+
+        ids = {seq: question_id for seq, question_id, _ in rows}
+        new = {seq for seq, _, is_new in rows if is_new}
+
+        elapsed = time.perf_counter() - started
+        self.report.questions += len(new)
+        self.report.answers += sum(1 for a in answers if a[0] in new)
+        self.report.updated += updated
+        self.report.skipped += len(batch) - len(new)
+        self.report.batches += 1
+        self.report.seconds += elapsed
+
+        if not self.quiet:
+            print(f"Batch {self.report.batches}: {len(new)} new of {len(batch)} "
+                  f"questions, {updated} updated in {elapsed * 1000:.0f} ms")
+
+        return ids
@@ -1,34 +1,164 @@
 
+import atexit
+import hmac
+import re
+import time
 import werkzeug
-from werkzeug.security import generate_password_hash
-from typing import Union
+from datetime import datetime
+from functools import wraps
+from typing import Any, Callable, Optional, Union
+from werkzeug.http import is_resource_modified
 from connection import (create_user_in_db, get_all_topics,
                         create_topic_in_db,
                         delete_topic_from_db,
+                        purge_hidden_topics,
+                        get_purge_progress,
                         get_topic_by_id,
+                        get_topic_catalog_version,
                         get_questions_for_topic,
+                        QUESTION_PAGE_MAX,
+                        QUESTION_PAGE_SIZE,
                         create_question_with_answers,
                         get_question_with_answers,
-                        delete_question,
-                        get_topic_id_for_question,
-                        insert_answer_history,
+                        update_question,
+                        record_practice_answer,
                         create_exam,
                         submit_exam,
                         get_exam,
                         get_exam_questions,
+                        get_exam_result,
+                        get_exam_result_cache_stats,
+                        get_question_cache_stats,
                         get_random_question_for_topic,
-                        get_signed_in_user)
-
-from flask import Flask, render_template, request, redirect, url_for, abort, session
+                        get_user_credentials,
+                        update_password_hash,
+                        get_pool_stats,
+                        get_replica_stats,
+                        has_replicas,
+                        read_from_primary,
+                        get_history_writer_stats,
+                        get_next_adaptive_question,
+                        get_monthly_accuracy,
+                        backfill_answer_rollup,
+                        get_topic_cache_stats,
+                        fill_pools,
+                        start_replica_monitor,
+                        start_topic_listener)
+
+from flask import Flask, render_template, request, redirect, url_for, abort, session, jsonify
 from os import environ as env
+from auth import HasherBusy, PasswordHasher, DEFAULT_PBKDF2_ITERATIONS
+from cache import LRUCache
+from querylog import query_log
+
+PG_INT_MAX = 2**31 - 1
 
 app = Flask(__name__)
 app.secret_key = env.get("SECRET_KEY", "default")
 
+hasher = PasswordHasher(
+    iterations=int(env.get("PASSWORD_HASH_ITERATIONS", DEFAULT_PBKDF2_ITERATIONS)),
+    workers=int(env.get("PASSWORD_HASH_WORKERS", 2)),
+    max_pending=int(env.get("PASSWORD_HASH_MAX_PENDING", 32)),
+    timeout=float(env.get("PASSWORD_HASH_TIMEOUT", 5)))
+atexit.register(hasher.close)
+
+# Rendered pages keyed on (route, version, user). Versions only move
+# forward, so stale entries are never hit again and just age out.
+_page_cache = LRUCache(max_size=int(env.get("PAGE_CACHE_SIZE", 512)))
+
+def cached_page(route: str, version: Any, render: Callable[[], str],
+                last_modified: Optional[datetime] = None) -> werkzeug.wrappers.response.Response:
+    """Serves a page that only changes when `version` does.
+
+    Answers If-None-Match / If-Modified-Since with 304 before `render` (and
+    any query it runs) is called, and otherwise reuses a rendered copy for
+    the same version and user."""
+
+    user_id = session.get("user_id")
+    etag = f"{route}-{version}-{user_id or 0}"
+
+    if not is_resource_modified(request.environ, etag=etag,
+                                last_modified=last_modified):
+        response = app.response_class(status=304)
+    else:
+        key = (route, version, user_id)
+        body = _page_cache.get(key)
+        if body is None:
+            body = render()
+            _page_cache.put(key, body)
+        response = app.make_response(body)
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.vary.add("Cookie")
+    # Shared caches may keep anonymous pages; everyone revalidates first.
+    if user_id:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+fill_pools()
+start_topic_listener()
+start_replica_monitor()
+
+# After a user writes, their reads stay on the primary for this long, which
+# should comfortably exceed REPLICA_MAX_LAG plus REPLICA_CHECK_INTERVAL.
+REPLICA_STICKY_SECONDS = float(env.get("REPLICA_STICKY_SECONDS", 10))
+
+QUERY_DEBUG_FOOTER = env.get("QUERY_DEBUG_FOOTER") == "1"
+
+@app.before_request
+def start_query_stats():
+    rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+    query_log.start_request(f"{request.method} {rule}")
+
+@app.after_request
+def add_query_stats(response):
+    finished = query_log.finish_request()
+    if finished is None:
+        return response
+
+    stats, elapsed = finished
+    response.headers["Server-Timing"] = stats.server_timing(elapsed)
+    if (QUERY_DEBUG_FOOTER and response.mimetype == "text/html"
+            and not response.direct_passthrough):
+        footer = render_template("_query_footer.html", stats=stats, elapsed=elapsed)
+        body = response.get_data(as_text=True)
+        if "</body>" in body:
+            body = body.replace("</body>", footer + "</body>")
+        else:
+            body += footer
+        response.set_data(body)
+    return response
+
+@app.before_request
+def route_reads():
+    # Reads made while handling a write, or soon after the user's last one,
+    # must see that write.
+    read_from_primary(request.method not in ("GET", "HEAD")
+                      or session.get("primary_reads_until", 0) > time.time())
+
+@app.after_request
+def stick_to_primary(response):
+    if (has_replicas() and request.method not in ("GET", "HEAD") and "user_id" in session
+            and response.status_code < 400):
+        session["primary_reads_until"] = time.time() + REPLICA_STICKY_SECONDS
+    return response
+
+@app.teardown_request
+def discard_query_stats(error):
+    # Requests that failed before after_request still count towards their route.
+    query_log.finish_request()
+
 @app.route("/")
-def home() -> str:
-    topics = get_all_topics()
-    return render_template("home.html", topics=topics)
+def home() -> werkzeug.wrappers.response.Response:
+    return cached_page(
+        "home", get_topic_catalog_version(),
+        lambda: render_template("home.html", topics=get_all_topics()))
 
 @app.route("/signup", methods=["GET", "POST"])
 def signup():
@@ -36,9 +166,7 @@ def signup():
         username = request.form["username"].strip()
         password = request.form["password"]
 
-        password_hash = generate_password_hash(password,
-                                               method='pbkdf2:sha256',
-                                               salt_length=16)
+        password_hash = hasher.hash(password)
         create_user_in_db(username, password_hash)
         return redirect(url_for("login"))
 
@@ -50,9 +178,17 @@ def login():
         username = request.form["username"]
         password = request.form["password"]
         
-        user_id = get_signed_in_user(username, password)
-        if user_id is None:
+        credentials = get_user_credentials(username)
+        if credentials is None:
+            return render_template("login.html", error="Invalid username or password.")
+
+        user_id, password_hash = credentials
+        ok, new_hash = hasher.verify(password_hash, password)
+        if not ok:
             return render_template("login.html", error="Invalid username or password.")
+        if new_hash:
+            update_password_hash(user_id, new_hash)
+
         session["user_id"] = user_id
         session["username"] = username
 
@@ -74,10 +210,26 @@ def delete_topic(topic_id: int) -> werkzeug.wrappers.response.Response:
     return redirect(url_for("home"))
 
 @app.route("/topics/<int:topic_id>")
-def topic_page(topic_id: int) -> str:
+def topic_page(topic_id: int) -> werkzeug.wrappers.response.Response:
     topic = get_topic_by_id(topic_id)
-    questions = get_questions_for_topic(topic_id)
-    return render_template("topic.html", topic=topic, questions=questions)
+    if topic is None:
+        abort(404)
+
+    before = request.args.get("before", type=int)
+    # Clamped before it goes into the cache key, so out-of-range limits
+    # share the clamped page's entry instead of each adding their own.
+    limit = request.args.get("limit", QUESTION_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, QUESTION_PAGE_MAX))
+
+    def render() -> str:
+        questions, next_before = get_questions_for_topic(topic_id, before, limit)
+        return render_template("topic.html", topic=topic, questions=questions,
+                               before=before, next_before=next_before,
+                               limit=limit if limit != QUESTION_PAGE_SIZE else None)
+
+    return cached_page(
+        f"topic-{topic_id}-{before or 0}-{limit}", topic["version"], render,
+        last_modified=topic["updated_at"])
 
 @app.route("/topics/<int:topic_id>/questions/new", methods=["GET", "POST"])
 def add_questions(topic_id: int) -> Union[str, werkzeug.wrappers.response.Response]:
@@ -106,22 +258,21 @@ def edit_question(question_id: int) -> Union[str, werkzeug.wrappers.response.Res
     if request.method == "POST":
         question_text = request.form["question_text"]
         answers = request.form.getlist("answers[]")
+        answer_ids = request.form.getlist("answer_ids[]")
         correct_indices = {int(i) for i in request.form.getlist("correct_answers[]")}
         context = request.form.get("contextual_info", "")
 
-        topic_id = get_topic_id_for_question(question_id)
-        if topic_id is None:
-            abort(404)
-
-        delete_question(question_id)
-
-        create_question_with_answers(
-            topic_id,
+        # answer_ids[] is parallel to answers[]; blank for newly added rows
+        answer_ids += [""] * (len(answers) - len(answer_ids))
+        topic_id = update_question(
+            question_id,
             question_text,
-            answers,
-            correct_indices,
-            context
+            context,
+            [(int(answer_id) if answer_id.isdigit() else None, text, idx in correct_indices)
+             for idx, (answer_id, text) in enumerate(zip(answer_ids, answers))]
         )
+        if topic_id is None:
+            abort(404)
 
         return redirect(url_for("topic_page", topic_id=topic_id))
 
@@ -137,7 +288,13 @@ def edit_question(question_id: int) -> Union[str, werkzeug.wrappers.response.Res
 
 @app.route("/topics/<int:topic_id>/test")
 def test_topic(topic_id: int) -> str:
-    question = get_random_question_for_topic(topic_id)
+    adaptive = request.args.get("mode") == "adaptive" and "user_id" in session
+
+    question = None
+    if adaptive:
+        question = get_next_adaptive_question(session["user_id"], topic_id)
+    if not question:
+        question = get_random_question_for_topic(topic_id)
 
     if not question:
         return render_template(
@@ -149,7 +306,8 @@ def test_topic(topic_id: int) -> str:
     return render_template(
         "test.html",
         topic_id=topic_id,
-        question=question
+        question=question,
+        mode="adaptive" if adaptive else None
     )
 
 @app.route("/topics/<int:topic_id>/test/submit", methods=["POST"])
@@ -158,11 +316,17 @@ def submit_answer(topic_id: int) -> werkzeug.wrappers.response.Response:
     if not user_id:
         return redirect(url_for("login"))
 
-    # question_id = int(request.form["question_id"])
     selected_answers = request.form.getlist("selected_answers")  # list of answer_ids
-    insert_answer_history(selected_answers, user_id)
+    try:
+        question_id = int(request.form["question_id"])
+        if not 0 < question_id <= PG_INT_MAX:
+            raise ValueError(f"Question id {question_id} out of range")
+        record_practice_answer(user_id, topic_id, question_id, selected_answers)
+    except ValueError:
+        abort(400)
 
-    return redirect(url_for("test_topic", topic_id=topic_id))
+    return redirect(url_for("test_topic", topic_id=topic_id,
+                            mode=request.form.get("mode") or None))
 
 @app.route("/exam/setup", methods=["GET", "POST"])
 def setup_exam():
@@ -172,8 +336,9 @@ def setup_exam():
     if request.method == "POST":
         num_questions = int(request.form["num_questions"])
         duration = int(request.form["duration"])
+        stratified = "stratified" in request.form
 
-        exam_id = create_exam(session["user_id"], num_questions, duration)
+        exam_id = create_exam(session["user_id"], num_questions, duration, stratified)
 
         return redirect(url_for("take_exam", exam_id=exam_id))
 
@@ -182,46 +347,145 @@ def setup_exam():
 @app.route("/exam/<int:exam_id>", methods=["GET", "POST"])
 def take_exam(exam_id):
     if request.method == "POST":
-        submit_exam(exam_id)
+        selections = {}
+        for key in request.form:
+            match = re.fullmatch(r"question_(\d+)\[\]", key)
+            if match:
+                try:
+                    ids = [int(match.group(1)), *map(int, request.form.getlist(key))]
+                except ValueError:
+                    abort(400)
+                # Ids go into int columns; anything else is a forged form.
+                if not all(0 < i <= PG_INT_MAX for i in ids):
+                    abort(400)
+                selections[ids[0]] = ids[1:]
+
+        if submit_exam(exam_id, selections) is None:
+            abort(404)
         return redirect(url_for("exam_result", exam_id=exam_id))
 
     exam = get_exam(exam_id)
+    if exam is None:
+        abort(404)
+    if exam["end_time"] is not None:
+        return redirect(url_for("exam_result", exam_id=exam_id))
+
     questions = get_exam_questions(exam_id)
 
     return render_template("take_exam.html",
                            exam=exam,
                            questions=questions)
-'''
-@app.route("/exam/<int:exam_id>/result")
-def exam_result(exam_id: int):
-    result = session.get("exam_result")
-
-    if not result:
-        return redirect(url_for("take_exam", exam_id=exam_id))
-
-    return render_template(
-        "exam_result.html",
-        exam_id=exam_id,
-        score_percent=result["score_percent"],
-        correct_count=result["correct_count"],
-        total=result["total"]
-    )
-'''
 
 @app.route("/exam/<int:exam_id>/result")
 def exam_result(exam_id: int):
-    result = session.get("exam_result")
-
-    if not result:
-        return redirect(url_for("take_exam", exam_id=exam_id))
+    # A finished exam's result never changes, so a client that already has
+    # it can be answered without touching the database. The tag carries the
+    # user, so only the owner's copy ever matches.
+    etag = f"exam-result-{exam_id}-{session.get('user_id') or 0}"
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        result = get_exam_result(exam_id)
+        if result is None:
+            # Only an exam still in progress has no result yet; sending a
+            # finished one back to take_exam would bounce straight here.
+            exam = get_exam(exam_id)
+            if (exam is None or exam["end_time"] is not None
+                    or exam["user_id"] != session.get("user_id")):
+                abort(404)
+            return redirect(url_for("take_exam", exam_id=exam_id))
+        if result["user_id"] != session.get("user_id"):
+            abort(404)
 
-    return render_template(
-        "exam_result.html",
-        exam_id=exam_id,
-        score_percent=result["score_percent"],
-        correct_count=result["correct_count"],
-        total=result["total"]
-    )
+        response = app.make_response(render_template(
+            "exam_result.html",
+            exam_id=exam_id,
+            score_percent=result["score_percent"],
+            correct_count=result["correct_count"],
+            total=result["total"],
+            questions=result["questions"]
+        ))
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response
+
+@app.route("/stats")
+def stats() -> str:
+    mine = request.args.get("mine") == "1" and session.get("user_id")
+    rows = get_monthly_accuracy(session["user_id"] if mine else None)
+    return render_template("stats.html", rows=rows, mine=bool(mine))
+
+@app.cli.command("backfill-rollup")
+def backfill_rollup():
+    """Rebuild answer_rollup from answer_history."""
+    count = backfill_answer_rollup()
+    print(f"Rebuilt answer_rollup: {count} rows")
+
+@app.cli.command("purge-topics")
+def purge_topics():
+    """Finish purging deleted topics, e.g. after a restart."""
+    for progress in purge_hidden_topics():
+        deleted = ", ".join(f"{n} {table}" for table, n in progress["deleted"].items())
+        status = f"failed: {progress['error']}" if progress["error"] else "purged"
+        print(f"Topic {progress['topic_id']} {status} ({deleted})")
+
+# Operational stats expose hostnames, query text and load. With STATS_TOKEN
+# set they need "Authorization: Bearer <token>"; without it only requests
+# from the machine itself get them. Anyone else gets a 404.
+STATS_TOKEN = env.get("STATS_TOKEN")
+
+def operator_only(view: Callable[..., Any]) -> Callable[..., Any]:
+    @wraps(view)
+    def guarded(*args: Any, **kwargs: Any) -> Any:
+        if STATS_TOKEN:
+            allowed = hmac.compare_digest(
+                request.headers.get("Authorization", ""), f"Bearer {STATS_TOKEN}")
+        else:
+            allowed = request.remote_addr in ("127.0.0.1", "::1")
+        if not allowed:
+            abort(404)
+        return view(*args, **kwargs)
+    return guarded
+
+@app.route("/stats/purge")
+@operator_only
+def purge_stats():
+    return jsonify(get_purge_progress())
+
+@app.route("/metrics")
+@operator_only
+def metrics():
+    return jsonify(query_log.stats())
+
+@app.route("/stats/pool")
+@operator_only
+def pool_stats():
+    return jsonify({**get_pool_stats(), "replicas": get_replica_stats()})
+
+@app.route("/stats/history-writer")
+@operator_only
+def history_writer_stats():
+    return jsonify(get_history_writer_stats())
+
+@app.route("/stats/auth")
+@operator_only
+def auth_stats():
+    return jsonify(hasher.stats())
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(error):
+    return "Too many sign-ins at once, please try again.", 503, {"Retry-After": "5"}
+
+@app.route("/stats/cache")
+@operator_only
+def cache_stats():
+    return jsonify({"topics": get_topic_cache_stats(),
+                    "exam_results": get_exam_result_cache_stats(),
+                    "questions": get_question_cache_stats(),
+                    "pages": _page_cache.stats()})
 
 @app.route("/logout")
 def logout():
@@ -0,0 +1,118 @@
+"""Applies the SQL migrations in seed/migrations, in file name order.
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list applied and pending migrations
+
+Each migration runs in its own transaction and is recorded in
+schema_migrations with a checksum, so it is applied exactly once. Migrations
+only ever add to the schema; they never drop tables holding data.
+"""
+import argparse
+import hashlib
+import os
+import sys
+from os import environ as env
+
+import psycopg2
+from dotenv import load_dotenv
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "seed", "migrations")
+
+# Arbitrary key for the advisory lock that keeps two runners apart
+LOCK_KEY = 7_301_955
+
+
+def load_migrations(path: str = MIGRATIONS_DIR) -> list[tuple[str, str]]:
+    """Returns (version, sql) for every migration file, in order."""
+
+    migrations = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".sql"):
+            with open(os.path.join(path, name), encoding="utf-8") as f:
+                migrations.append((name[:-len(".sql")], f.read()))
+    return migrations
+
+
+def checksum(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+def applied_migrations(conn: psycopg2.extensions.connection) -> dict[str, str]:
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+              version TEXT PRIMARY KEY,
+              checksum TEXT NOT NULL,
+              applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+        cur.execute("SELECT version, checksum FROM schema_migrations;")
+        applied = dict(cur.fetchall())
+    conn.commit()
+    return applied
+
+
+def migrate(conn: psycopg2.extensions.connection) -> list[str]:
+    """Applies pending migrations and returns their versions."""
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s);", (LOCK_KEY,))
+    try:
+        applied = applied_migrations(conn)
+        done = []
+        for version, sql in load_migrations():
+            if version in applied:
+                if applied[version] != checksum(sql):
+                    print(f"warning: {version} changed after it was applied")
+                continue
+
+            print(f"Applying {version}")
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sql)
+                    cur.execute("""
+                        INSERT INTO schema_migrations (version, checksum)
+                        VALUES (%s, %s);
+                    """, (version, checksum(sql)))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            done.append(version)
+        return done
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (LOCK_KEY,))
+        conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--status", action="store_true",
+                        help="list migrations without applying any")
+    args = parser.parse_args()
+
+    # A plain connection: importing connection.py would set up pools, the
+    # replica monitor's state and the history writer just to run DDL.
+    load_dotenv()
+    conn = psycopg2.connect(
+        env.get("DATABASE_URL", "dbname=revisor user=RuneTek host=localhost"))
+    try:
+        if args.status:
+            applied = applied_migrations(conn)
+            for version, _ in load_migrations():
+                print(f"{'applied' if version in applied else 'pending':<8} {version}")
+            return
+
+        done = migrate(conn)
+        print(f"Applied {len(done)} migration(s)" if done else "Database is up to date")
+    except psycopg2.Error as e:
+        print(f"Migration failed: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
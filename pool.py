@@ -0,0 +1,207 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+import psycopg2
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections with checkout timeout,
+    stale connection health checks and usage statistics.
+
+    Connections are opened on demand; call fill() to open `min_size` of
+    them up front."""
+
+    def __init__(self,
+                 connect: Callable[[], psycopg2.extensions.connection],
+                 min_size: int = 1,
+                 max_size: int = 10,
+                 timeout: float = 5.0,
+                 max_idle: float = 30.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size")
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+
+        self._lock = threading.Condition()
+        # Idle connections with the time they were returned to the pool
+        self._idle: list[tuple[psycopg2.extensions.connection, float]] = []
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._checkout_time = 0.0
+        self._max_checkout_time = 0.0
+        self._closed = False
+
+    def _open(self) -> psycopg2.extensions.connection:
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+
+    def _is_healthy(self, conn: psycopg2.extensions.connection,
+                    idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - idle_since < self.max_idle:
+            return True
+
+        # Connection has been idle long enough that the server (or a proxy)
+        # may have dropped it; ping before handing it out.
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn: psycopg2.extensions.connection) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._lock:
+            self._size -= 1
+            self._discarded += 1
+            self._lock.notify()
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        """Checks out a connection, waiting up to `timeout` seconds for one
+        to become free when the pool is exhausted."""
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+
+                if not self._idle and self._size >= self.max_size:
+                    self._waiting += 1
+                    try:
+                        while not self._idle and self._size >= self.max_size:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                self._timeouts += 1
+                                raise PoolTimeout(
+                                    f"No connection available within {self.timeout}s")
+                            self._lock.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    conn, idle_since = None, 0.0
+                    self._size += 1
+
+            if conn is None:
+                conn = self._open()
+            elif not self._is_healthy(conn, idle_since):
+                self._discard(conn)
+                continue
+
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._in_use += 1
+                self._checkouts += 1
+                self._checkout_time += elapsed
+                self._max_checkout_time = max(self._max_checkout_time, elapsed)
+            return conn
+
+    def putconn(self, conn: psycopg2.extensions.connection,
+                discard: bool = False) -> None:
+        """Returns a connection to the pool, rolling back any open transaction."""
+
+        with self._lock:
+            self._in_use -= 1
+
+        if not discard and not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard or conn.closed or self._closed:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[psycopg2.extensions.connection]:
+        """Checks out a connection for the duration of the block, committing
+        on success and rolling back if the block raises."""
+
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.putconn(conn, discard=broken or conn.closed != 0)
+
+    def fill(self) -> None:
+        """Opens connections until `min_size` are available."""
+
+        while True:
+            with self._lock:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            conn = self._open()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+                self._lock.notify()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._lock.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "max_size": self.max_size,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "avg_checkout_ms": (1000 * self._checkout_time / self._checkouts
+                                    if self._checkouts else 0.0),
+                "max_checkout_ms": 1000 * self._max_checkout_time,
+            }
+
@@ -0,0 +1,193 @@
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+# Literals left in statements built by execute_values / sql.SQL
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUES_LIST = re.compile(r"\(\?(?:,\s*\?)*\)(?:,\s*\(\?(?:,\s*\?)*\))+")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql: Any) -> str:
+    """Collapses a statement to its shape: placeholders and literals become
+    ?, whitespace is squeezed and multi-row VALUES lists fold to one row."""
+
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    sql = sql.replace("%s", "?")
+    sql = re.sub(r"%\(\w+\)s", "?", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _SPACE.sub(" ", sql).strip()
+    return _VALUES_LIST.sub("(?) ...", sql)
+
+
+@dataclass
+class QueryRecord:
+    fingerprint: str
+    seconds: float
+    rows: int
+
+
+@dataclass
+class RequestStats:
+    """Queries and connection checkouts made while handling one request."""
+
+    route: str
+    started: float = field(default_factory=time.perf_counter)
+    queries: list[QueryRecord] = field(default_factory=list)
+    checkouts: int = 0
+    checkout_seconds: float = 0.0
+
+    @property
+    def db_seconds(self) -> float:
+        return sum(q.seconds for q in self.queries)
+
+    def server_timing(self, total_seconds: float) -> str:
+        return (f'db;dur={1000 * self.db_seconds:.2f};desc="{len(self.queries)} queries", '
+                f'pool;dur={1000 * self.checkout_seconds:.2f};'
+                f'desc="{self.checkouts} checkouts", '
+                f'app;dur={1000 * total_seconds:.2f}')
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("query_stats", default=None)
+
+
+class QueryLog:
+    """Aggregates query timings per fingerprint and per route, and logs
+    statements slower than `slow_ms` and fingerprints repeated more than
+    `repeat_warning` times in one request (the usual N+1 shape)."""
+
+    def __init__(self, slow_ms: float = 200.0, repeat_warning: int = 10):
+        self.slow_ms = slow_ms
+        self.repeat_warning = repeat_warning
+        self._lock = threading.Lock()
+        self._queries: dict[str, dict[str, Any]] = {}
+        self._routes: dict[str, dict[str, Any]] = {}
+
+    def start_request(self, route: str) -> RequestStats:
+        stats = RequestStats(route)
+        _current.set(stats)
+        return stats
+
+    def current(self) -> Optional[RequestStats]:
+        return _current.get()
+
+    def bind(self, stats: Optional[RequestStats]) -> None:
+        """Attributes queries made in the current context (e.g. a task on
+        another event loop) to a request started elsewhere."""
+        _current.set(stats)
+
+    def record_query(self, sql: Any, seconds: float, rows: int) -> None:
+        record = QueryRecord(fingerprint(sql), seconds, rows)
+        stats = _current.get()
+        if stats is not None:
+            stats.queries.append(record)
+
+        with self._lock:
+            entry = self._queries.setdefault(record.fingerprint, {
+                "calls": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0})
+            entry["calls"] += 1
+            entry["total_ms"] += 1000 * seconds
+            entry["max_ms"] = max(entry["max_ms"], 1000 * seconds)
+            entry["rows"] += max(rows, 0)
+
+        if 1000 * seconds >= self.slow_ms:
+            logger.warning("Slow query (%.1f ms, %d rows, route %s): %s",
+                           1000 * seconds, rows,
+                           stats.route if stats else "-", record.fingerprint)
+
+    def record_checkout(self, seconds: float) -> None:
+        stats = _current.get()
+        if stats is not None:
+            stats.checkouts += 1
+            stats.checkout_seconds += seconds
+
+    def finish_request(self) -> Optional[tuple[RequestStats, float]]:
+        """Closes the current request's stats and folds them into the route
+        totals. Returns the stats and the request's duration in seconds."""
+
+        stats = _current.get()
+        if stats is None:
+            return None
+        _current.set(None)
+        elapsed = time.perf_counter() - stats.started
+
+        counts: dict[str, int] = {}
+        for query in stats.queries:
+            counts[query.fingerprint] = counts.get(query.fingerprint, 0) + 1
+        for sql, count in counts.items():
+            if count > self.repeat_warning:
+                logger.warning("Route %s ran the same query %d times in one request: %s",
+                               stats.route, count, sql)
+
+        with self._lock:
+            route = self._routes.setdefault(stats.route, {
+                "requests": 0, "queries": 0, "max_queries": 0, "checkouts": 0,
+                "db_ms": 0.0, "total_ms": 0.0, "max_ms": 0.0})
+            route["requests"] += 1
+            route["queries"] += len(stats.queries)
+            route["max_queries"] = max(route["max_queries"], len(stats.queries))
+            route["checkouts"] += stats.checkouts
+            route["db_ms"] += 1000 * stats.db_seconds
+            route["total_ms"] += 1000 * elapsed
+            route["max_ms"] = max(route["max_ms"], 1000 * elapsed)
+        return stats, elapsed
+
+    def stats(self, top: int = 20) -> dict[str, Any]:
+        with self._lock:
+            routes = {
+                name: {
+                    "requests": r["requests"],
+                    "avg_queries": r["queries"] / r["requests"],
+                    "max_queries": r["max_queries"],
+                    "avg_checkouts": r["checkouts"] / r["requests"],
+                    "avg_db_ms": r["db_ms"] / r["requests"],
+                    "avg_ms": r["total_ms"] / r["requests"],
+                    "max_ms": r["max_ms"],
+                }
+                for name, r in self._routes.items()
+            }
+            queries = sorted(({"fingerprint": sql, **q} for sql, q in self._queries.items()),
+                             key=lambda q: q["total_ms"], reverse=True)[:top]
+        return {"routes": routes, "queries": queries}
+
+
+query_log = QueryLog()
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that reports every statement's duration and row count to
+    `query_log`."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            query_log.record_query(query, time.perf_counter() - started, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            query_log.record_query(query, time.perf_counter() - started, self.rowcount)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            query_log.record_query(sql, time.perf_counter() - started, self.rowcount)
@@ -0,0 +1,203 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+_PRIMARY_SQL = "SELECT now(), pg_current_wal_lsn();"
+
+_REPLICA_SQL = """
+    SELECT pg_is_in_recovery(),
+           pg_last_wal_replay_lsn(),
+           (SELECT status FROM pg_stat_wal_receiver);
+"""
+
+
+def _lsn(value: str) -> int:
+    """Converts a pg_lsn such as '16/B374D848' to an integer."""
+
+    high, low = value.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class _Replica:
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.available = False
+        self.replayed_through: Optional[datetime] = None
+        self.lag: Optional[float] = None
+        self.polled_at = 0.0
+        self.error: Optional[str] = None
+        self.reads = 0
+        self.busy = 0
+
+
+class ReplicaSet:
+    """Tracks the health of read replicas and picks one for each read.
+
+    Every `interval` seconds a daemon thread samples the primary's current
+    WAL position and then asks each replica how far it has replayed. A
+    replica has everything the primary had committed at the latest sample
+    whose position it has reached, so its lag is measured against the
+    primary's own clock and position rather than the replica's idea of
+    being caught up: a standby that lost its upstream falls behind as soon
+    as the primary writes, and one without a streaming WAL receiver takes no
+    reads at all.
+
+    choose() only hands out replicas that answered the last poll and lag
+    the primary by at most `max_lag` seconds, so a replica that goes away
+    or falls behind stops taking reads within one interval. Until its first
+    poll succeeds, or once polls stop coming back, a replica takes no
+    reads."""
+
+    def __init__(self, dsns: list[str], primary_dsn: str,
+                 connect: Callable[[str], psycopg2.extensions.connection],
+                 max_lag: float = 1.0, interval: float = 1.0, history: int = 60):
+        self._replicas = [_Replica(dsn) for dsn in dsns]
+        self._primary_dsn = primary_dsn
+        self._connect = connect
+        self._samples: deque[tuple[datetime, int]] = deque(maxlen=history)
+        self.max_lag = max_lag
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+        self.fallbacks = 0
+
+    def __bool__(self) -> bool:
+        return bool(self._replicas)
+
+    def choose(self, fresh_since: Optional[datetime] = None) -> Optional[str]:
+        """Returns the DSN of a healthy replica, round robin, or None when
+        the read should go to the primary. With `fresh_since`, only replicas
+        known to have replayed everything committed up to then qualify."""
+
+        polled_after = time.monotonic() - 3 * self.interval
+        with self._lock:
+            usable = [r for r in self._replicas
+                      if r.available and r.polled_at >= polled_after
+                      and r.lag is not None and r.lag <= self.max_lag
+                      and (fresh_since is None or r.replayed_through >= fresh_since)]
+            if not usable:
+                if self._replicas:
+                    self.fallbacks += 1
+                return None
+            replica = usable[next(self._next) % len(usable)]
+            replica.reads += 1
+            return replica.dsn
+
+    def mark_down(self, dsn: str, error: Any) -> None:
+        """Stops reads going to a replica until its next successful poll."""
+
+        with self._lock:
+            for replica in self._replicas:
+                if replica.dsn == dsn:
+                    replica.available = False
+                    replica.error = str(error).strip()
+
+    def mark_busy(self, dsn: str) -> None:
+        """Counts a read that found the replica's pool exhausted. The replica
+        stays in rotation: being busy is not being down."""
+
+        with self._lock:
+            for replica in self._replicas:
+                if replica.dsn == dsn:
+                    replica.busy += 1
+
+    def start(self) -> Optional[threading.Thread]:
+        if not self._replicas:
+            return None
+        thread = threading.Thread(target=self._run, name="replica-monitor", daemon=True)
+        thread.start()
+        return thread
+
+    def _query(self, conns: dict[str, psycopg2.extensions.connection],
+               dsn: str, sql: str) -> tuple:
+        conn = conns.get(dsn)
+        try:
+            if conn is None or conn.closed:
+                conn = conns[dsn] = self._connect(dsn)
+                conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(sql)
+                return cur.fetchone()
+        except psycopg2.Error:
+            if conn is not None:
+                conn.close()
+            conns.pop(dsn, None)
+            raise
+
+    def _replayed_through(self, replay_lsn: Optional[str]) -> Optional[datetime]:
+        """The latest primary sample the replica has replayed past."""
+
+        if replay_lsn is None:
+            return None
+        replayed = _lsn(replay_lsn)
+        for sampled_at, position in reversed(self._samples):
+            if position <= replayed:
+                return sampled_at
+        return None
+
+    def _run(self) -> None:
+        conns: dict[str, psycopg2.extensions.connection] = {}
+        while True:
+            try:
+                sampled_at, position = self._query(conns, self._primary_dsn, _PRIMARY_SQL)
+                self._samples.append((sampled_at, _lsn(position)))
+            except psycopg2.Error as e:
+                # Without the primary's position there is no telling how
+                # stale the replicas are.
+                for replica in self._replicas:
+                    self.mark_down(replica.dsn, f"primary unreachable: {e}")
+                time.sleep(self.interval)
+                continue
+
+            for replica in self._replicas:
+                try:
+                    in_recovery, replay_lsn, receiver = self._query(
+                        conns, replica.dsn, _REPLICA_SQL)
+                except psycopg2.Error as e:
+                    if replica.available:
+                        logger.warning("Replica unavailable, reading from primary: %s", e)
+                    self.mark_down(replica.dsn, e)
+                    continue
+
+                replayed_through = None
+                if not in_recovery:
+                    error = "not a standby"
+                elif receiver != "streaming":
+                    error = f"WAL receiver is {receiver or 'not running'}"
+                else:
+                    replayed_through = self._replayed_through(replay_lsn)
+                    error = (None if replayed_through is not None
+                             else f"more than {len(self._samples)} polls behind")
+                if error and replica.available:
+                    logger.warning("Replica %s, reading from primary", error)
+
+                with self._lock:
+                    replica.available = error is None
+                    replica.replayed_through = replayed_through
+                    replica.lag = ((sampled_at - replayed_through).total_seconds()
+                                   if replayed_through is not None else None)
+                    replica.polled_at = time.monotonic()
+                    replica.error = error
+            time.sleep(self.interval)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "fallbacks": self.fallbacks,
+                "replicas": [{
+                    "host": psycopg2.extensions.parse_dsn(r.dsn).get("host", "localhost"),
+                    "available": r.available,
+                    "lag_seconds": r.lag,
+                    "reads": r.reads,
+                    "busy": r.busy,
+                    "error": r.error,
+                } for r in self._replicas],
+            }
@@ -0,0 +1,161 @@
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Callable, Iterable, Optional
+
+
+class _TopicIds:
+    """Question ids for one topic with O(1) add, remove and indexed access."""
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self.ids = array("q", ids)
+        self.positions = {qid: i for i, qid in enumerate(self.ids)}
+
+    def add(self, question_id: int) -> None:
+        if question_id in self.positions:
+            return
+        self.positions[question_id] = len(self.ids)
+        self.ids.append(question_id)
+
+    def remove(self, question_id: int) -> None:
+        index = self.positions.pop(question_id, None)
+        if index is None:
+            return
+        # Swap the last id into the hole so removal never shifts the array.
+        last = self.ids.pop()
+        if index < len(self.ids):
+            self.ids[index] = last
+            self.positions[last] = index
+
+
+class QuestionSampler:
+    """Keeps question ids per topic in memory so random questions can be
+    drawn in O(k) instead of sorting the question table with ORDER BY RANDOM()."""
+
+    def __init__(self, load: Callable[[], Iterable[tuple[int, int]]], ttl: float = 600.0,
+                 rng: Optional[random.Random] = None):
+        self._load = load
+        self.ttl = ttl
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._topics: dict[int, _TopicIds] = {}
+        self._loaded_at: Optional[float] = None
+
+    def _fresh(self) -> bool:
+        return (self._loaded_at is not None
+                and time.monotonic() - self._loaded_at < self.ttl)
+
+    def _ensure_loaded(self) -> None:
+        if self._fresh():
+            return
+
+        # Only one thread reloads; the others wait for its result.
+        with self._load_lock:
+            if self._fresh():
+                return
+
+            topics: dict[int, list[int]] = {}
+            for topic_id, question_id in self._load():
+                topics.setdefault(topic_id, []).append(question_id)
+
+            with self._lock:
+                self._topics = {t: _TopicIds(ids) for t, ids in topics.items()}
+                self._loaded_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = None
+
+    def add(self, topic_id: int, question_id: int) -> None:
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._topics.setdefault(topic_id, _TopicIds()).add(question_id)
+
+    def remove(self, topic_id: int, question_id: int) -> None:
+        with self._lock:
+            ids = self._topics.get(topic_id)
+            if ids is not None:
+                ids.remove(question_id)
+
+    def discard(self, question_ids: Iterable[int]) -> None:
+        """Removes question ids from whichever topics hold them."""
+
+        question_ids = list(question_ids)
+        with self._lock:
+            for ids in self._topics.values():
+                for question_id in question_ids:
+                    ids.remove(question_id)
+
+    def drop_topic(self, topic_id: int) -> None:
+        with self._lock:
+            self._topics.pop(topic_id, None)
+
+    def count(self, topic_id: Optional[int] = None) -> int:
+        self._ensure_loaded()
+        with self._lock:
+            if topic_id is not None:
+                ids = self._topics.get(topic_id)
+                return len(ids.ids) if ids else 0
+            return sum(len(ids.ids) for ids in self._topics.values())
+
+    def sample_topic(self, topic_id: int, k: int = 1) -> list[int]:
+        """Draws up to k distinct question ids uniformly from one topic."""
+
+        self._ensure_loaded()
+        with self._lock:
+            ids = self._topics.get(topic_id)
+            if not ids or not ids.ids:
+                return []
+            return self._rng.sample(ids.ids, min(k, len(ids.ids)))
+
+    def sample(self, k: int) -> list[int]:
+        """Draws up to k distinct question ids uniformly from the whole bank.
+
+        Indices are drawn over the concatenation of all topics and mapped
+        back to a topic with a binary search over cumulative topic sizes.
+        """
+
+        self._ensure_loaded()
+        with self._lock:
+            topics = [ids.ids for ids in self._topics.values() if ids.ids]
+            bounds = list(accumulate(len(ids) for ids in topics))
+            total = bounds[-1] if bounds else 0
+
+            picked = []
+            for index in self._rng.sample(range(total), min(k, total)):
+                t = bisect_right(bounds, index)
+                offset = index - (bounds[t - 1] if t else 0)
+                picked.append(topics[t][offset])
+            return picked
+
+    def sample_stratified(self, k: int) -> list[int]:
+        """Draws k question ids spread across topics in proportion to each
+        topic's size (largest remainder rounding), shuffled together."""
+
+        self._ensure_loaded()
+        with self._lock:
+            topics = [ids.ids for ids in self._topics.values() if ids.ids]
+            total = sum(len(ids) for ids in topics)
+            k = min(k, total)
+            if k == 0:
+                return []
+
+            quotas = [k * len(ids) / total for ids in topics]
+            counts = [int(q) for q in quotas]
+            by_remainder = sorted(range(len(topics)),
+                                  key=lambda i: quotas[i] - counts[i],
+                                  reverse=True)
+            for i in by_remainder[:k - sum(counts)]:
+                counts[i] += 1
+
+            picked = []
+            for ids, count in zip(topics, counts):
+                picked.extend(self._rng.sample(ids, count))
+
+        self._rng.shuffle(picked)
+        return picked
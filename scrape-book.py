@@ -1,37 +1,27 @@
 from __future__ import annotations
 
-import pdfplumber
 import psycopg2
 
-import re
-from typing import List
+import argparse
+from os import environ as env
+from typing import Collection, Iterable, Iterator, List, Optional, Tuple
 from dataclasses import dataclass
+from dotenv import load_dotenv
+
+from cache import TOPIC_CHANNEL
+from importer import BulkLoader, chapter_topics, extract_lines, run_pipeline
+from tokenizer import (BLANK, CHAPTER, QUESTION_TYPE, QUESTION, ANSWER,
+                       CORRECT_RESPONSE, EXPLANATION, KNOWLEDGE_AREA, tokenize)
 
 
 PDF_PATH = "pdfcoffee.com_cdmp-data-management-fundamentals-exam-questions-on-dmbok2-2nd-edition-b095j177p4-4-pdf-free.pdf"
 
+load_dotenv()
+
 def get_connection() -> psycopg2.extensions.connection:
     """Establishes and returns a connection to the PostgreSQL database."""
 
-    return psycopg2.connect(
-        dbname="revisor",
-        user="RuneTek",
-        host="localhost")
-
-
-def extract_lines(pdf_path: str) -> List[str]:
-    lines: List[str] = []
-
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()
-
-            if text:
-                lines.extend(text.split("\n"))
-
-    return lines
-
-
+    return psycopg2.connect(env.get("DATABASE_URL", "dbname=revisor user=RuneTek host=localhost"))
 
 
 @dataclass
@@ -42,21 +32,23 @@ class ParsedQuestion:
     explanation: str
 
 
-def parse_questions(lines: List[str], chapter: int) -> List[ParsedQuestion]:
-    questions: List[ParsedQuestion] = []
+def parse_questions(lines: Iterable[str],
+                    chapters: Optional[Collection[int]] = None) -> Iterator[Tuple[int, ParsedQuestion]]:
+    """Yields (chapter, question) for every question in `chapters` (all
+    chapters when None) in a single pass, each as soon as the next one starts."""
 
+    tokens = tokenize(lines)
     current_question = None
+    question_chapter = None
     current_chapter = None
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        i += 1
 
-        if not line:
+    for kind, line in tokens:
+
+        if kind == BLANK:
             continue
 
         # --- Chapter check ---
-        if line.startswith("Chapter"):
+        if kind == CHAPTER:
             parts = line.split()
             if len(parts) >= 2 and parts[1].isdigit():
                 current_chapter = int(parts[1])
@@ -64,21 +56,23 @@ def parse_questions(lines: List[str], chapter: int) -> List[ParsedQuestion]:
                 current_chapter = None
             continue
 
-        # Skip lines not in the chapter we want
-        if current_chapter != chapter:
+        # Skip lines not in the chapters we want
+        if current_chapter is None or (chapters is not None and current_chapter not in chapters):
             continue
 
         # --- Question Type ---
-        if line.startswith("Question Type"):
+        if kind == QUESTION_TYPE:
             # skip next line (multiple-choice or multi-select)
-            i += 1
+            next(tokens, None)
             continue
 
-               # --- Question start ---
-        if line.startswith("Question "):
-            # Save previous question
+        # --- Question start ---
+        if kind == QUESTION:
+            # Emit previous question
             if current_question:
-                questions.append(current_question)
+                yield question_chapter, current_question
+
+            question_chapter = current_chapter
 
             # Initialize new question
             current_question = ParsedQuestion(
@@ -90,66 +84,52 @@ def parse_questions(lines: List[str], chapter: int) -> List[ParsedQuestion]:
 
             # Accumulate question text until we hit "Question Type"
             question_lines = []
-            while i < len(lines):
-                next_line = lines[i].strip()
-                if not next_line:
-                    i += 1
+            for next_kind, next_line in tokens:
+                if next_kind == BLANK:
                     continue
-                if next_line.startswith("Question Type"):
-                    i += 1  # skip the next line (multiple-choice / multi-select)
+                if next_kind == QUESTION_TYPE:
                     break
                 question_lines.append(next_line)
-                i += 1
 
             current_question.question = " ".join(question_lines)
             continue
+
         # --- Answer section ---
-        a_match = re.match(r"Answer\s+\d+", line)
-        if a_match:
+        if kind == ANSWER:
             # Next non-empty line is the answer text
-            while i < len(lines):
-                ans_line = lines[i].strip()
-                i += 1
-                if ans_line:
+            for next_kind, ans_line in tokens:
+                if next_kind != BLANK:
                     current_question.answers.append(ans_line)
                     break
             continue
 
         # --- Correct Response ---
-        if line.startswith("Correct Response"):
+        if kind == CORRECT_RESPONSE:
             # Next non-empty line has the indices
-            while i < len(lines):
-                correct_line = lines[i].strip()
-                i += 1
-                if correct_line:
+            for next_kind, correct_line in tokens:
+                if next_kind != BLANK:
                     current_question.correct = [int(x) for x in correct_line.split(",") if x.strip().isdigit()]
                     break
             continue
 
         # --- Explanation ---
-        if line.startswith("Explanation"):
+        if kind == EXPLANATION:
             # Next non-empty line is the explanation
-            while i < len(lines):
-                expl_line = lines[i].strip()
-                i += 1
-                if expl_line:
+            for next_kind, expl_line in tokens:
+                if next_kind != BLANK:
                     current_question.explanation = expl_line
                     break
             # Skip the next Knowledge Area lines
-            while i < len(lines):
-                ka_line = lines[i].strip()
-                i += 1
-                if ka_line.startswith("Knowledge Area"):
+            for next_kind, _ in tokens:
+                if next_kind == KNOWLEDGE_AREA:
                     # skip next line too
-                    i += 1
+                    next(tokens, None)
                     break
             continue
 
-    # Save last question
+    # Emit last question
     if current_question:
-        questions.append(current_question)
-
-    return questions
+        yield question_chapter, current_question
 
 
 def get_or_create_topic(conn: psycopg2.extensions.connection, topic_name: str) -> int:
@@ -160,7 +140,7 @@ def get_or_create_topic(conn: psycopg2.extensions.connection, topic_name: str) -
             """
             SELECT topic_id
             FROM topic
-            WHERE topic_name = %s
+            WHERE topic_name = %s AND hidden_at IS NULL
             """,
             (topic_name,),
         )
@@ -181,78 +161,46 @@ def get_or_create_topic(conn: psycopg2.extensions.connection, topic_name: str) -
 
         topic_id: int = cur.fetchone()[0]
 
-        conn.commit()
-
-        return topic_id
-
-
-def insert_question(
-    conn: psycopg2.extensions.connection,
-    topic_id: int,
-    q: ParsedQuestion,
-) -> int:
-
-    with conn.cursor() as cur:
-
-        cur.execute(
-            """
-            INSERT INTO question (topic_id, question_text, contextual_info)
-            VALUES (%s,%s,%s)
-            RETURNING question_id
-            """,
-            (
-                topic_id,
-                q.question,
-                q.explanation,
-            ),
-        )
-
-        question_id: int = cur.fetchone()[0]
-
-        for i, answer in enumerate(q.answers, start=1):
-            print(f"Inserting answer: {answer} (correct: {i in q.correct})")
-            print(i, q.correct)
-            cur.execute(
-                """
-                INSERT INTO answer (question_id, answer_text, is_correct)
-                VALUES (%s,%s,%s)
-                """,
-                (
-                    question_id,
-                    answer,
-                    i in q.correct,
-                ),
-            )
+        # Let running web processes drop their cached topic catalog
+        cur.execute(f"NOTIFY {TOPIC_CHANNEL};")
 
         conn.commit()
 
-        return question_id
+        return topic_id
 
 
 def main() -> None:
 
-    topic_name = "DAMA Chapter 17 - Data Management and Organizational Change Management"
+    parser = argparse.ArgumentParser(description="Import DMBOK chapter questions")
+    parser.add_argument("--chapters", type=int, nargs="+", metavar="N",
+                        choices=sorted(chapter_topics),
+                        help="chapters to import (default: all)")
+    parser.add_argument("--quiet", action="store_true",
+                        help="only print the final summary")
+    args = parser.parse_args()
+
+    # Only chapters with a topic; the PDF has other "Chapter N" headings.
+    chapters = set(args.chapters or chapter_topics)
 
     conn = get_connection()
 
     try:
 
-        topic_id = get_or_create_topic(conn, topic_name)
+        topic_ids = {}
 
-        lines = extract_lines(PDF_PATH)
+        questions = parse_questions(extract_lines(PDF_PATH), chapters)
 
-        chapter = 17
+        loader = BulkLoader(conn, quiet=args.quiet)
 
-        questions = parse_questions(lines, chapter)
+        def load(batch: List[Tuple[int, ParsedQuestion]]) -> None:
+            for chapter, _ in batch:
+                if chapter not in topic_ids:
+                    topic_ids[chapter] = get_or_create_topic(conn, chapter_topics[chapter])
+            loader.load([(topic_ids[chapter], q) for chapter, q in batch])
 
-        print(f"Parsed {len(questions)} questions")
+        run_pipeline(questions, load)
 
-        for q in questions:
-            insert_question(conn, topic_id, q)
-            print(f"Question: {q.question}")
-            print(f"Answers: {', '.join(q.answers)}")
-            print(f"Correct: {q.correct}")
-            print(f"Explanation: {q.explanation}")
+        print(loader.report)
 
         print("Import complete")
 
@@ -1,16 +1,12 @@
-DROP TABLE IF EXISTS answer_history;
-DROP TABLE IF EXISTS users;
-DROP TABLE IF EXISTS answer;
-DROP TABLE IF EXISTS question;
-DROP TABLE IF EXISTS topic;
+-- Tables as first shipped in seed/schema.sql.
 
-CREATE TABLE topic (
+CREATE TABLE IF NOT EXISTS topic (
   topic_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
   topic_name VARCHAR(32) NOT NULL,
   created_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
-CREATE TABLE question (
+CREATE TABLE IF NOT EXISTS question (
   question_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
   topic_id INTEGER NOT NULL,
   question_text TEXT NOT NULL,
@@ -19,7 +15,7 @@ CREATE TABLE question (
     FOREIGN KEY (topic_id) REFERENCES topic(topic_id)
 );
 
-CREATE TABLE answer (
+CREATE TABLE IF NOT EXISTS answer (
   answer_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
   question_id INTEGER NOT NULL,
   answer_text TEXT NOT NULL,
@@ -28,7 +24,7 @@ CREATE TABLE answer (
     FOREIGN KEY (question_id) REFERENCES question(question_id)
 );
 
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
   user_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
   username TEXT UNIQUE NOT NULL,
   password_hash TEXT NOT NULL,
@@ -36,7 +32,7 @@ CREATE TABLE users (
 );
 
 
-CREATE TABLE answer_history (
+CREATE TABLE IF NOT EXISTS answer_history (
   answer_history_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
   answer_time TIMESTAMPTZ NOT NULL DEFAULT now(),
   answer_id INTEGER NOT NULL,
@@ -47,7 +43,7 @@ CREATE TABLE answer_history (
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
 
-CREATE TABLE exam (
+CREATE TABLE IF NOT EXISTS exam (
   exam_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
   user_id INTEGER NOT NULL,
   start_time TIMESTAMPTZ NOT NULL DEFAULT now(),
@@ -59,7 +55,7 @@ CREATE TABLE exam (
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
 
-CREATE TABLE exam_question (
+CREATE TABLE IF NOT EXISTS exam_question (
   exam_question_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
   exam_id INTEGER NOT NULL,
   question_id INTEGER NOT NULL,
@@ -69,7 +65,7 @@ CREATE TABLE exam_question (
     FOREIGN KEY (question_id) REFERENCES question(question_id)
 );
 
-CREATE TABLE exam_answer (
+CREATE TABLE IF NOT EXISTS exam_answer (
   exam_answer_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
   exam_id INTEGER NOT NULL,
   question_id INTEGER NOT NULL,
@@ -80,12 +76,6 @@ CREATE TABLE exam_answer (
 );
 
 -- Indexes
-CREATE INDEX idx_question_topic_id ON question(topic_id);
-CREATE INDEX idx_answer_question_id ON answer(question_id);
-CREATE INDEX idx_answer_history_user_id ON answer_history(user_id);
-
-
--- SEED DATA
-INSERT INTO topic (topic_name) VALUES
-('Collibra'),
-('DAMA DMBOX');
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_question_topic_id ON question(topic_id);
+CREATE INDEX IF NOT EXISTS idx_answer_question_id ON answer(question_id);
+CREATE INDEX IF NOT EXISTS idx_answer_history_user_id ON answer_history(user_id);
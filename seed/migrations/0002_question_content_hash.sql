@@ -0,0 +1,5 @@
+-- Content hash used by the importers to skip questions already loaded.
+ALTER TABLE question ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_question_content_hash ON question(content_hash)
+  WHERE content_hash IS NOT NULL;
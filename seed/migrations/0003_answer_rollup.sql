@@ -0,0 +1,15 @@
+-- Monthly answer counts per topic and user, kept up to date by
+-- insert_answer_history() so reports never scan answer_history.
+-- Fill it for existing history with `flask --app main backfill-rollup`.
+CREATE TABLE IF NOT EXISTS answer_rollup (
+  month DATE NOT NULL,
+  topic_id INTEGER NOT NULL,
+  user_id INTEGER NOT NULL,
+  correct INTEGER NOT NULL DEFAULT 0,
+  total INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (month, topic_id, user_id),
+  CONSTRAINT fk_rollup_topic
+    FOREIGN KEY (topic_id) REFERENCES topic(topic_id),
+  CONSTRAINT fk_rollup_user
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
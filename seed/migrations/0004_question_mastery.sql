@@ -0,0 +1,17 @@
+-- Spaced-repetition state per user and question, updated on every
+-- practice answer
+CREATE TABLE IF NOT EXISTS question_mastery (
+  user_id INTEGER NOT NULL,
+  question_id INTEGER NOT NULL,
+  topic_id INTEGER NOT NULL,
+  streak INTEGER NOT NULL DEFAULT 0,
+  last_seen TIMESTAMPTZ NOT NULL DEFAULT now(),
+  due_at TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY (user_id, question_id),
+  CONSTRAINT fk_mastery_user
+    FOREIGN KEY (user_id) REFERENCES users(user_id),
+  CONSTRAINT fk_mastery_question
+    FOREIGN KEY (question_id) REFERENCES question(question_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_question_mastery_due ON question_mastery(user_id, topic_id, due_at);
@@ -0,0 +1,12 @@
+-- Read model for finished exams, written once when the exam is graded
+CREATE TABLE IF NOT EXISTS exam_result (
+  exam_id INTEGER PRIMARY KEY,
+  user_id INTEGER NOT NULL,
+  finished_at TIMESTAMPTZ NOT NULL,
+  score_percent NUMERIC NOT NULL,
+  correct_count INTEGER NOT NULL,
+  total INTEGER NOT NULL,
+  questions JSONB NOT NULL,
+  CONSTRAINT fk_exam_result_exam
+    FOREIGN KEY (exam_id) REFERENCES exam(exam_id)
+);
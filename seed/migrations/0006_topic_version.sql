@@ -0,0 +1,4 @@
+-- Bumped whenever a topic or its questions change; used for page ETags.
+ALTER TABLE topic
+  ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1,
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
@@ -0,0 +1,4 @@
+-- Supports keyset pagination of a topic's questions; also covers plain
+-- topic_id lookups, so the single-column index is no longer needed.
+CREATE INDEX IF NOT EXISTS idx_question_topic_question ON question(topic_id, question_id);
+DROP INDEX IF EXISTS idx_question_topic_id;
@@ -0,0 +1,25 @@
+-- create_exam() stores each question's position in the exam; number the
+-- questions of existing exams in insertion order.
+ALTER TABLE exam_question ADD COLUMN IF NOT EXISTS position INTEGER;
+
+UPDATE exam_question eq
+SET position = numbered.position
+FROM (
+  SELECT exam_question_id,
+         row_number() OVER (PARTITION BY exam_id ORDER BY exam_question_id) AS position
+  FROM exam_question
+) numbered
+WHERE eq.exam_question_id = numbered.exam_question_id
+  AND eq.position IS NULL;
+
+ALTER TABLE exam_question ALTER COLUMN position SET NOT NULL;
+
+-- get_exam_questions() and grading read an exam's questions in order
+CREATE UNIQUE INDEX IF NOT EXISTS idx_exam_question_exam_position
+  ON exam_question(exam_id, position);
+CREATE INDEX IF NOT EXISTS idx_exam_answer_exam_id ON exam_answer(exam_id);
+-- Grading counts each question's correct answers
+CREATE INDEX IF NOT EXISTS idx_answer_correct ON answer(question_id)
+  WHERE is_correct;
+-- get_or_create_topic() in the importers looks topics up by name
+CREATE INDEX IF NOT EXISTS idx_topic_topic_name ON topic(topic_name);
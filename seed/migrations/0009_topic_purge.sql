@@ -0,0 +1,9 @@
+-- Deleted topics are hidden at once and purged in the background.
+ALTER TABLE topic ADD COLUMN IF NOT EXISTS hidden_at TIMESTAMPTZ;
+
+-- Lets the purge find a topic's dependent rows batch by batch
+CREATE INDEX IF NOT EXISTS idx_answer_history_answer_id ON answer_history(answer_id);
+CREATE INDEX IF NOT EXISTS idx_exam_answer_question_id ON exam_answer(question_id);
+CREATE INDEX IF NOT EXISTS idx_exam_question_question_id ON exam_question(question_id);
+CREATE INDEX IF NOT EXISTS idx_question_mastery_topic_id ON question_mastery(topic_id);
+CREATE INDEX IF NOT EXISTS idx_answer_rollup_topic_id ON answer_rollup(topic_id);
@@ -0,0 +1,38 @@
+-- Exams finished before exam_result existed have no row there, and their
+-- result page has nothing to show. Grade them from their stored answers
+-- the way submit_exam() does and keep the score they were given then.
+INSERT INTO exam_result (exam_id, user_id, finished_at, score_percent,
+                         correct_count, total, questions)
+SELECT e.exam_id, e.user_id, e.end_time, COALESCE(e.score_percent, 0),
+       COUNT(*) FILTER (WHERE g.is_correct),
+       COUNT(g.question_id),
+       COALESCE(json_agg(json_build_object(
+                    'question_id', g.question_id,
+                    'question_text', g.question_text,
+                    'is_correct', g.is_correct)
+                ORDER BY g.position) FILTER (WHERE g.question_id IS NOT NULL),
+                '[]')
+FROM exam e
+LEFT JOIN LATERAL (
+  SELECT eq.question_id, eq.position, q.question_text,
+         c.correct_total > 0
+           AND COUNT(a.answer_id) FILTER (WHERE a.is_correct) = c.correct_total
+           AND COUNT(a.answer_id) FILTER (WHERE NOT a.is_correct) = 0
+           AS is_correct
+  FROM exam_question eq
+  JOIN question q ON q.question_id = eq.question_id
+  CROSS JOIN LATERAL (
+    SELECT COUNT(*) AS correct_total
+    FROM answer
+    WHERE question_id = eq.question_id AND is_correct
+  ) c
+  LEFT JOIN exam_answer ea
+    ON ea.exam_id = eq.exam_id AND ea.question_id = eq.question_id
+  LEFT JOIN answer a
+    ON a.answer_id = ea.answer_id AND a.question_id = eq.question_id
+  WHERE eq.exam_id = e.exam_id
+  GROUP BY eq.question_id, eq.position, q.question_text, c.correct_total
+) g ON true
+WHERE e.end_time IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM exam_result r WHERE r.exam_id = e.exam_id)
+GROUP BY e.exam_id, e.user_id, e.end_time, e.score_percent;
@@ -0,0 +1,5 @@
+-- Starter topics for a new database; safe to run more than once.
+INSERT INTO topic (topic_name)
+SELECT name
+FROM (VALUES ('Collibra'), ('DAMA DMBOX')) AS t(name)
+WHERE NOT EXISTS (SELECT 1 FROM topic WHERE topic_name = t.name);
@@ -2,11 +2,12 @@
 set -e
 
 DB_NAME="revisor"
-SETUP_FILE="schema.sql"
+cd "$(dirname "$0")"
 
-chmod +x "$SETUP_FILE"
-echo "🌱 Seeding database: $DB_NAME"
+echo "🔧 Migrating database: $DB_NAME"
+python3 ../migrate.py
 
-psql -d "$DB_NAME" -f "$SETUP_FILE"
+echo "🌱 Seeding database: $DB_NAME"
+psql -d "$DB_NAME" -f seed_data.sql
 
 echo "Database setup successfully"
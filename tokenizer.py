@@ -0,0 +1,57 @@
+"""Line classifier shared by the PDF importers.
+
+Each stripped line is classified once and tagged with the kind of marker it
+starts with, so the parsers dispatch on an int instead of re-running
+startswith/regex checks per line.
+"""
+import re
+from typing import Iterable, Iterator, Tuple
+
+BLANK = 0
+CHAPTER = 1
+PRACTICE_TEST = 2
+QUESTION_TYPE = 3
+QUESTION = 4
+ANSWER = 5
+CORRECT_RESPONSE = 6
+EXPLANATION = 7
+KNOWLEDGE_AREA = 8
+TEXT = 9
+
+# Marker prefixes grouped by first character, most specific first, so a
+# line costs one dict lookup and at most two startswith calls.
+_MARKERS = {
+    "C": (("Chapter", CHAPTER), ("Correct Response", CORRECT_RESPONSE)),
+    "P": (("Practice Test", PRACTICE_TEST),),
+    "Q": (("Question Type", QUESTION_TYPE), ("Question ", QUESTION)),
+    "A": (("Answer", ANSWER),),
+    "E": (("Explanation", EXPLANATION),),
+    "K": (("Knowledge Area", KNOWLEDGE_AREA),),
+}
+
+# "Answer" only counts as a marker when followed by a number.
+_ANSWER = re.compile(r"Answer\s+\d")
+
+DIGITS = re.compile(r"\d+")
+
+Token = Tuple[int, str]
+
+
+def tokenize(lines: Iterable[str]) -> Iterator[Token]:
+    """Yields (kind, stripped line) for every line."""
+
+    markers = _MARKERS.get
+    answer = _ANSWER.match
+    for line in lines:
+        line = line.strip()
+        if not line:
+            yield BLANK, line
+            continue
+
+        kind = TEXT
+        for prefix, marker in markers(line[0], ()):
+            if line.startswith(prefix):
+                if marker != ANSWER or answer(line):
+                    kind = marker
+                break
+        yield kind, line
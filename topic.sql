@@ -1,19 +1,15 @@
 SELECT
-    DATE_TRUNC('month', ah.answer_time) AS month_start,
+    r.month AS month_start,
     t.topic_name,
-    COUNT(*) FILTER (WHERE a.is_correct) AS correct_answers,
-    --COUNT(*) FILTER (WHERE NOT a.is_correct) AS incorrect_answers,
-    -- COUNT(*) AS total_answers,
+    SUM(r.correct) AS correct_answers,
+    --SUM(r.total) - SUM(r.correct) AS incorrect_answers,
+    -- SUM(r.total) AS total_answers,
     ROUND(
-        100.0 * COUNT(*) FILTER (WHERE a.is_correct) / COUNT(*),
+        100.0 * SUM(r.correct) / NULLIF(SUM(r.total), 0),
         2
     ) AS accuracy_percent
-FROM answer_history ah
-JOIN answer a 
-    ON ah.answer_id = a.answer_id
-JOIN question q 
-    ON a.question_id = q.question_id
+FROM answer_rollup r
 JOIN topic t 
-    ON q.topic_id = t.topic_id
+    ON r.topic_id = t.topic_id
 GROUP BY month_start, t.topic_name
-ORDER BY topic_name ASC;
\ No newline at end of file
+ORDER BY topic_name ASC;